@@ -2,6 +2,13 @@ from __future__ import division
 import os
 import sys
 import struct
+import mmap
+import bisect
+import threading
+import tempfile
+import ctypes, ctypes.util
+from errno import EINTR, EXDEV, ENOSYS, EINVAL, EOPNOTSUPP
+from collections import OrderedDict
 
 
 def fmtslice(slice):
@@ -16,10 +23,956 @@ def fmtslice(slice):
 	return res
 
 
-def FileBuffer(fname, mode='rb'):
+structs = {}
+
+def getstruct(fmt):
+	# compiled once per format string
+	st = structs.get(fmt)
+	if st is None:
+		st = structs[fmt] = struct.Struct(fmt)
+	return st
+
+
+def FileBuffer(fname, mode='rb', mmap=False, cache=False, blocksize=2**16, cachesize=2**26, prefetch=False, dontneed=False, stats=None, journal=False):
+	if journal:
+		# an interrupted commit is undone before anything else looks at the file
+		rollback(fname, fname + journalsuffix)
+
 	fp = open(fname, mode)
-	return Buffer(fp, slice(0, os.path.getsize(fname)))
-	
+	size = os.path.getsize(fname)
+
+	# can't map empty files
+	if mmap and size > 0:
+		source = MmapSource(fp, stats)
+	else:
+		source = FileSource(fp, stats)
+
+	if prefetch:
+		source = PrefetchSource(source, size, dontneed=dontneed)
+
+	if cache:
+		source = CachedSource(source, blocksize, cachesize)
+
+	if journal:
+		source = OverlaySource(source, size, fname + journalsuffix)
+
+	return Buffer(fp, slice(0, size), source)
+
+
+def PipeBuffer(fp, window=2**26, spill=False, stats=None):
+	# non-seekable input (stdin, a pipe from ffmpeg). only the last `window`
+	# bytes are kept for looking back, in memory or in a temp file.
+	return StreamBuffer(fp, 0, StreamSource(fp, window, spill, stats))
+
+
+def ChainBuffer(fnames, mode='rb', mmap=False, cache=False, blocksize=2**16, cachesize=2**26, prefetch=False, dontneed=False, stats=None):
+	# several files, one address space (e.g. split camera recordings)
+	parts = [
+		FileBuffer(fname, mode, mmap=mmap, prefetch=prefetch, dontneed=dontneed, stats=stats)
+		for fname in fnames
+	]
+	assert parts, "nothing to chain"
+
+	source = ChainSource([part.source for part in parts], [len(part) for part in parts])
+	size = source.size
+
+	if cache:
+		source = CachedSource(source, blocksize, cachesize)
+
+	return Buffer(parts[0].fp, slice(0, size), source)
+
+
+# ======================================================================
+# positional I/O and posix_fadvise. python 2 has neither os.pread nor
+# os.posix_fadvise, so they go through libc where there is one.
+
+FADV_NORMAL     = 0
+FADV_RANDOM     = 1
+FADV_SEQUENTIAL = 2
+FADV_WILLNEED   = 3
+FADV_DONTNEED   = 4
+
+_libc = None
+if os.name == 'posix':
+	try:
+		_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+	except OSError:
+		_libc = None
+
+def _libcfn(names, restype, argtypes):
+	# first of names that libc has (the *64 variants take 64 bit offsets on 32 bit systems)
+	for name in names:
+		fn = getattr(_libc, name, None) if (_libc is not None) else None
+		if fn is not None:
+			fn.restype = restype
+			fn.argtypes = argtypes
+			return fn
+	return None
+
+_fadvise = _libcfn(['posix_fadvise64', 'posix_fadvise'], ctypes.c_int,
+	[ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int])
+_pread = _libcfn(['pread64', 'pread'], ctypes.c_ssize_t,
+	[ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64])
+_pwrite = _libcfn(['pwrite64', 'pwrite'], ctypes.c_ssize_t,
+	[ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_int64])
+_copy_file_range = _libcfn(['copy_file_range'], ctypes.c_ssize_t,
+	[ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t, ctypes.c_uint])
+
+has_pread = hasattr(os, 'pread') or (_pread is not None and _pwrite is not None)
+
+def _checkerrno():
+	errno = ctypes.get_errno()
+	if errno != EINTR:
+		raise OSError(errno, os.strerror(errno))
+
+def pread(fd, nbytes, offset):
+	if hasattr(os, 'pread'):
+		return os.pread(fd, nbytes, offset)
+
+	buf = ctypes.create_string_buffer(nbytes)
+	got = 0
+	while got < nbytes:
+		n = _pread(fd, ctypes.addressof(buf) + got, nbytes - got, offset + got)
+		if n < 0:
+			_checkerrno()
+		elif n == 0: # EOF
+			break
+		else:
+			got += n
+
+	return ctypes.string_at(buf, got)
+
+def pwrite(fd, data, offset):
+	done = 0
+	while done < len(data):
+		if hasattr(os, 'pwrite'):
+			n = os.pwrite(fd, data[done:], offset + done)
+		else:
+			n = _pwrite(fd, data[done:], len(data) - done, offset + done)
+			if n < 0:
+				_checkerrno()
+				continue
+		done += n
+
+def _close(source):
+	# sources that hold threads, maps or further files have a close()
+	close = getattr(source, 'close', None)
+	if close is not None:
+		close()
+
+def fadvise(fp, offset, length, advice):
+	if hasattr(os, 'posix_fadvise'):
+		os.posix_fadvise(fp.fileno(), offset, length, advice)
+	elif _fadvise is not None:
+		_fadvise(fp.fileno(), offset, length, advice)
+
+def copy_range(infp, offset, length, outfp, outoffset, blocksize=2**24):
+	# length bytes from offset in infp to outoffset in outfp. in the kernel
+	# (copy_file_range) where it can, else in blocks aligned in the input
+	if _copy_file_range is not None:
+		inoff = ctypes.c_int64(offset)
+		outoff = ctypes.c_int64(outoffset)
+
+		while length > 0:
+			n = _copy_file_range(infp.fileno(), ctypes.byref(inoff), outfp.fileno(), ctypes.byref(outoff), min(length, 2**30), 0)
+			if n > 0:
+				length -= n
+			elif n == 0: # EOF
+				break
+			else:
+				errno = ctypes.get_errno()
+				if errno in (EXDEV, ENOSYS, EINVAL, EOPNOTSUPP):
+					break # not for these files, the rest goes the slow way
+				elif errno != EINTR:
+					raise OSError(errno, os.strerror(errno))
+
+		(offset, outoffset) = (inoff.value, outoff.value)
+
+	while length > 0:
+		n = min(length, blocksize - (offset % blocksize))
+		if has_pread:
+			data = pread(infp.fileno(), n, offset)
+		else:
+			infp.seek(offset)
+			data = infp.read(n)
+		if not data:
+			break
+		if has_pread:
+			pwrite(outfp.fileno(), data, outoffset)
+		else:
+			outfp.seek(outoffset)
+			outfp.write(data)
+		offset += len(data)
+		outoffset += len(data)
+		length -= len(data)
+
+	assert length == 0, "input ended %d bytes early" % length
+
+# ======================================================================
+# I/O accounting, for catching parsers that read more (or more often) than
+# they should. sources that hit the disk record into an IOStats if given one.
+
+class IOStats(object):
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reads = 0
+		self.bytesread = 0
+		self.writes = 0
+		self.byteswritten = 0
+		self.seeks = 0 # reads not starting where the last one ended
+		self.backseeks = 0
+		self.sizes = {} # read size, rounded up to a power of two -> count
+
+	def record(self, nbytes, jump=0, write=False):
+		# jump: offset - end of the previous access on that file
+		with self.lock:
+			if write:
+				self.writes += 1
+				self.byteswritten += nbytes
+			else:
+				self.reads += 1
+				self.bytesread += nbytes
+				bucket = 1 << max(0, nbytes-1).bit_length()
+				self.sizes[bucket] = self.sizes.get(bucket, 0) + 1
+
+			if jump:
+				self.seeks += 1
+				self.backseeks += (jump < 0)
+
+	def __repr__(self):
+		return '<IOStats %d reads, %d bytes, %d seeks (%d backward), %d writes, %d bytes>' % (
+			self.reads, self.bytesread, self.seeks, self.backseeks, self.writes, self.byteswritten)
+
+	def report(self):
+		lines = [
+			"I/O: %d reads, %d bytes read, %d seeks (%d backward)" % (
+				self.reads, self.bytesread, self.seeks, self.backseeks),
+		]
+		if self.writes:
+			lines.append("I/O: %d writes, %d bytes written" % (self.writes, self.byteswritten))
+
+		if self.sizes:
+			lines.append("read sizes:")
+			for bucket in sorted(self.sizes):
+				lines.append("  <= %10d bytes: %d" % (bucket, self.sizes[bucket]))
+
+		return '\n'.join(lines)
+
+# ======================================================================
+# sources: positional access to the underlying bytes, shared by all slices
+
+class FileSource(object):
+	# positional reads, no seek pointer is shared between slices, so
+	# several threads can parse the same file.
+	# without pread (windows), seek+read under a lock.
+	def __init__(self, fp, stats=None):
+		self.fp = fp
+		self.fd = fp.fileno()
+		self.lock = threading.Lock()
+		self.stats = stats
+		self.lastend = 0
+
+	def _record(self, offset, nbytes, write=False):
+		self.stats.record(nbytes, offset - self.lastend, write)
+		self.lastend = offset + nbytes
+
+	def read(self, offset, nbytes):
+		if has_pread:
+			data = pread(self.fd, nbytes, offset)
+		else:
+			with self.lock:
+				self.fp.seek(offset)
+				data = self.fp.read(nbytes)
+
+		if self.stats is not None:
+			self._record(offset, len(data))
+
+		return data
+
+	def view(self, offset, nbytes):
+		return self.read(offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		return st.unpack(self.read(offset, st.size))
+
+	def write(self, offset, data):
+		if self.stats is not None:
+			self._record(offset, len(data), write=True)
+
+		with self.lock:
+			if has_pread:
+				self.fp.flush() # anything written through fp goes first
+				pwrite(self.fd, data, offset)
+			else:
+				self.fp.seek(offset)
+				self.fp.write(data)
+
+
+class MmapSource(object):
+	# with stats, accesses are counted like reads; the page faults behind
+	# them are not
+	def __init__(self, fp, stats=None):
+		self.fp = fp
+		self.stats = stats
+		self.lastend = 0
+		writable = ('+' in fp.mode) or ('w' in fp.mode)
+		self.map = mmap.mmap(
+			fp.fileno(), 0,
+			access=(mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ))
+
+	def close(self):
+		# arrays and views from view() still point into the map; it's
+		# unmapped once the last of them is gone, not here
+		self.map = None
+
+	def _record(self, offset, nbytes, write=False):
+		self.stats.record(nbytes, offset - self.lastend, write)
+		self.lastend = offset + nbytes
+
+	def read(self, offset, nbytes):
+		data = self.map[offset : offset+nbytes]
+		if self.stats is not None:
+			self._record(offset, len(data))
+		return data
+
+	def view(self, offset, nbytes):
+		# zero-copy. py2's memoryview doesn't accept mmap objects.
+		if self.stats is not None:
+			self._record(offset, max(0, min(nbytes, len(self.map) - offset)))
+		return buffer(self.map, offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		if self.stats is not None:
+			self._record(offset, st.size)
+		return st.unpack_from(self.map, offset)
+
+	def write(self, offset, data):
+		assert offset + len(data) <= len(self.map), "can't grow a mapped file"
+		if self.stats is not None:
+			self._record(offset, len(data), write=True)
+		self.map[offset : offset+len(data)] = data
+
+
+class ChainSource(object):
+	def __init__(self, sources, sizes):
+		assert len(sources) == len(sizes)
+		self.sources = sources
+		self.fp = sources[0].fp
+		self.sizes = sizes
+
+		self.starts = []
+		self.size = 0
+		for size in sizes:
+			self.starts.append(self.size)
+			self.size += size
+
+	def close(self):
+		for source in self.sources:
+			_close(source)
+			source.fp.close()
+
+	def _parts(self, offset, nbytes):
+		# -> (part index, offset within part, nbytes within part)
+		i = bisect.bisect_right(self.starts, offset) - 1
+		while nbytes > 0 and i < len(self.sources):
+			partoffset = offset - self.starts[i]
+			partbytes = min(nbytes, self.sizes[i] - partoffset)
+			if partbytes > 0:
+				yield (i, partoffset, partbytes)
+				offset += partbytes
+				nbytes -= partbytes
+			i += 1
+
+	def read(self, offset, nbytes):
+		pieces = [
+			self.sources[i].read(partoffset, partbytes)
+			for (i, partoffset, partbytes) in self._parts(offset, nbytes)
+		]
+		return pieces[0] if len(pieces) == 1 else ''.join(pieces)
+
+	def view(self, offset, nbytes):
+		pieces = list(self._parts(offset, nbytes))
+		if len(pieces) == 1:
+			(i, partoffset, partbytes) = pieces[0]
+			return self.sources[i].view(partoffset, partbytes)
+		else:
+			return self.read(offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		return st.unpack(self.read(offset, st.size))
+
+	def write(self, offset, data):
+		p = 0
+		for (i, partoffset, partbytes) in self._parts(offset, len(data)):
+			self.sources[i].write(partoffset, data[p : p+partbytes])
+			p += partbytes
+		assert p == len(data), "can't write past the last part"
+
+
+class PrefetchSource(object):
+	# for sequential scans: a background thread reads the next few blocks
+	# ahead of wherever the last read was, so parsing and disk I/O overlap.
+	# with dontneed, the kernel is told to drop pages we're done with.
+	def __init__(self, source, size, blocksize=2**20, depth=8, dontneed=False):
+		self.source = source
+		self.fp = source.fp
+		self.size = size
+		self.blocksize = blocksize
+		self.depth = depth
+		self.dontneed = dontneed
+
+		self.cond = threading.Condition()
+		self.blocks = {} # block index -> data, only [cursor, cursor+depth)
+		self.pending = set()
+		self.errors = {} # block index -> exc_info of its failed fetch, for the reader
+		self.cursor = 0
+		self.dropped = 0 # bytes before this were DONTNEED'd
+		self.closed = False
+
+		self.hits = 0
+		self.misses = 0
+
+		fadvise(self.fp, 0, 0, FADV_SEQUENTIAL)
+
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def __repr__(self):
+		return '<PrefetchSource %d x %d bytes ahead, %d hits, %d misses>' % (
+			self.depth, self.blocksize, self.hits, self.misses)
+
+	def close(self):
+		# stops the thread, then closes what it read from
+		with self.cond:
+			if self.closed:
+				return
+			self.closed = True
+			self.cond.notify_all()
+		self.thread.join()
+		_close(self.source)
+
+	def _fetch(self, index):
+		return self.source.read(index * self.blocksize, self.blocksize)
+
+	def _wanted(self):
+		# called with self.cond held
+		nblocks = (self.size + self.blocksize - 1) // self.blocksize
+		for index in xrange(self.cursor, min(nblocks, self.cursor + self.depth)):
+			if index not in self.blocks and index not in self.pending and index not in self.errors:
+				return index
+		return None
+
+	def _run(self):
+		while True:
+			with self.cond:
+				index = self._wanted()
+				while index is None and not self.closed:
+					self.cond.wait()
+					index = self._wanted()
+
+				if self.closed:
+					return
+
+				self.pending.add(index)
+
+			fadvise(self.fp, (index+1) * self.blocksize, self.blocksize, FADV_WILLNEED)
+			try:
+				data = self._fetch(index)
+			except Exception:
+				# raised again in whoever reads that block
+				with self.cond:
+					self.pending.discard(index)
+					self.errors[index] = sys.exc_info()
+					self.cond.notify_all()
+				continue
+
+			with self.cond:
+				self.pending.discard(index)
+				if self.cursor <= index < self.cursor + self.depth:
+					self.blocks[index] = data
+				self.cond.notify_all()
+
+	def _advance(self, index):
+		with self.cond:
+			if index == self.cursor:
+				return
+
+			self.cursor = index
+			for cache in (self.blocks, self.errors):
+				for i in cache.keys():
+					if not (index <= i < index + self.depth):
+						del cache[i]
+			self.cond.notify_all()
+
+		if self.dontneed and index * self.blocksize > self.dropped:
+			fadvise(self.fp, self.dropped, index * self.blocksize - self.dropped, FADV_DONTNEED)
+			self.dropped = index * self.blocksize
+
+	def _block(self, index):
+		with self.cond:
+			while index in self.pending:
+				self.cond.wait()
+			if index in self.errors:
+				(type, value, traceback) = self.errors.pop(index)
+				raise type, value, traceback
+			data = self.blocks.get(index)
+			if data is None:
+				self.pending.add(index) # keep the thread off it
+
+		if data is None:
+			self.misses += 1
+			try:
+				data = self._fetch(index)
+			finally:
+				with self.cond:
+					self.pending.discard(index)
+					if data is not None and self.cursor <= index < self.cursor + self.depth:
+						self.blocks[index] = data
+					self.cond.notify_all()
+		else:
+			self.hits += 1
+
+		return data
+
+	def read(self, offset, nbytes):
+		if nbytes <= 0:
+			return ''
+
+		first = offset // self.blocksize
+		last = (offset + nbytes - 1) // self.blocksize
+		self._advance(first)
+
+		if last - first >= self.depth:
+			return self.source.read(offset, nbytes)
+
+		if first == last:
+			data = self._block(first)
+		else:
+			data = ''.join(self._block(i) for i in xrange(first, last+1))
+
+		skip = offset - first * self.blocksize
+		return data[skip : skip+nbytes]
+
+	def view(self, offset, nbytes):
+		return self.read(offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		return st.unpack(self.read(offset, st.size))
+
+	def write(self, offset, data):
+		first = offset // self.blocksize
+		last = (offset + len(data) - 1) // self.blocksize
+		with self.cond:
+			while self.pending:
+				self.cond.wait()
+			for i in xrange(first, last+1):
+				self.blocks.pop(i, None)
+
+		self.source.write(offset, data)
+
+
+class StreamSource(object):
+	# reads forward from fp as far as asked for. keeps a ring buffer of the
+	# most recent `window` bytes; stream offset o lives at o % window.
+	def __init__(self, fp, window=2**26, spill=False, stats=None):
+		self.fp = fp
+		self.stats = stats
+		self.window = window
+		self.size = 0 # bytes read from fp so far
+		self.eof = False
+
+		if spill:
+			self.ring = None
+			self.spill = tempfile.TemporaryFile()
+		else:
+			self.ring = bytearray()
+			self.spill = None
+
+	def close(self):
+		if self.spill:
+			self.spill.close()
+
+	def _store(self, offset, data):
+		while data:
+			pos = offset % self.window
+			piece = data[:self.window - pos]
+
+			if self.spill:
+				pwrite(self.spill.fileno(), piece, pos)
+			else:
+				self.ring[pos : pos+len(piece)] = piece
+
+			offset += len(piece)
+			data = data[len(piece):]
+
+	def _load(self, offset, nbytes):
+		pieces = []
+		while nbytes > 0:
+			pos = offset % self.window
+			count = min(nbytes, self.window - pos)
+
+			if self.spill:
+				pieces.append(pread(self.spill.fileno(), count, pos))
+			else:
+				pieces.append(str(self.ring[pos : pos+count]))
+
+			offset += count
+			nbytes -= count
+
+		return pieces[0] if len(pieces) == 1 else ''.join(pieces)
+
+	def fill(self, upto=None):
+		# read until `upto` bytes are known, or to EOF if None. -> bytes known
+		while not self.eof and (upto is None or self.size < upto):
+			# no further than asked, that would push out what's being looked at
+			want = 2**16 if (upto is None) else (upto - self.size)
+			data = self.fp.read(min(want, self.window))
+			if self.stats is not None:
+				self.stats.record(len(data))
+			if not data:
+				self.eof = True
+				break
+
+			self._store(self.size, data)
+			self.size += len(data)
+
+		return self.size
+
+	def read(self, offset, nbytes):
+		self.fill(offset + nbytes)
+		nbytes = max(0, min(nbytes, self.size - offset))
+
+		assert offset >= self.size - self.window, \
+			"stream offset %d has left the window (%d bytes read, window %d)" % (offset, self.size, self.window)
+		assert nbytes <= self.window, "read of %d bytes is larger than the window" % nbytes
+
+		return self._load(offset, nbytes)
+
+	def view(self, offset, nbytes):
+		return self.read(offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		data = self.read(offset, st.size)
+		assert len(data) == st.size, "stream ended at %d" % self.size
+		return st.unpack(data)
+
+	def write(self, offset, data):
+		assert False, "streams are read-only"
+
+
+journalsuffix = '.journal'
+journalmagic = 'FBJ1'
+
+class OverlaySource(object):
+	# collects writes in memory (reads see them), then commit() applies
+	# them in offset order. before touching the file, the bytes about to be
+	# overwritten go into an undo journal, which rollback() replays if the
+	# commit didn't finish. writes may extend the file.
+	def __init__(self, source, size, journalname):
+		self.source = source
+		self.fp = source.fp
+		self.basesize = size
+		self.size = size
+		self.journalname = journalname
+
+		self.lock = threading.Lock()
+		self.starts = [] # sorted, segments don't overlap or touch
+		self.segments = {} # start -> bytearray
+
+	def close(self):
+		# uncommitted patches are dropped
+		_close(self.source)
+
+	def __repr__(self):
+		return '<OverlaySource %d patches, %d bytes>' % (
+			len(self.starts), sum(len(seg) for seg in self.segments.itervalues()))
+
+	def _overlapping(self, start, stop):
+		# indices into self.starts of segments touching [start, stop]
+		i = bisect.bisect_right(self.starts, stop)
+		res = []
+		while i > 0 and self.starts[i-1] + len(self.segments[self.starts[i-1]]) >= start:
+			i -= 1
+			res.append(i)
+		return res[::-1]
+
+	def write(self, offset, data):
+		stop = offset + len(data)
+
+		with self.lock:
+			indices = self._overlapping(offset, stop)
+			lo = min([offset] + [self.starts[i] for i in indices])
+			hi = max([stop] + [self.starts[i] + len(self.segments[self.starts[i]]) for i in indices])
+
+			merged = bytearray(hi - lo)
+			for i in indices:
+				start = self.starts[i]
+				segment = self.segments.pop(start)
+				merged[start-lo : start-lo+len(segment)] = segment
+			merged[offset-lo : stop-lo] = data
+
+			if indices:
+				del self.starts[indices[0] : indices[-1]+1]
+			bisect.insort(self.starts, lo)
+			self.segments[lo] = merged
+
+			self.size = max(self.size, hi)
+
+	def read(self, offset, nbytes):
+		nbytes = max(0, min(nbytes, self.size - offset))
+		data = self.source.read(offset, min(nbytes, max(0, self.basesize - offset)))
+
+		if not self.starts:
+			return data
+
+		stop = offset + nbytes
+		with self.lock:
+			indices = [
+				i for i in self._overlapping(offset, stop)
+				if offset < self.starts[i] + len(self.segments[self.starts[i]])
+				and self.starts[i] < stop
+			]
+			if not indices and len(data) == nbytes:
+				return data
+
+			res = bytearray(data)
+			res.extend('\x00' * (nbytes - len(res))) # past the old end, not written
+			for i in indices:
+				start = self.starts[i]
+				segment = self.segments[start]
+				a = max(start, offset)
+				b = min(start + len(segment), stop)
+				res[a-offset : b-offset] = segment[a-start : b-start]
+
+		return str(res)
+
+	def view(self, offset, nbytes):
+		return self.read(offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		return st.unpack(self.read(offset, st.size))
+
+	def discard(self):
+		with self.lock:
+			self.starts = []
+			self.segments = {}
+			self.size = self.basesize
+
+	def commit(self):
+		with self.lock:
+			if not self.starts:
+				return
+
+			# undo journal: original size, then (offset, length, old bytes) per patch
+			with open(self.journalname, 'wb') as jf:
+				jf.write(journalmagic + struct.pack(">Q", self.basesize))
+				for start in self.starts:
+					length = max(0, min(len(self.segments[start]), self.basesize - start))
+					jf.write(struct.pack(">QQ", start, length))
+					jf.write(self.source.read(start, length))
+				jf.flush()
+				os.fsync(jf.fileno())
+
+			for start in self.starts:
+				self.source.write(start, str(self.segments[start]))
+
+			self.fp.flush()
+			os.fsync(self.fp.fileno())
+			os.unlink(self.journalname)
+
+			self.basesize = self.size
+			self.starts = []
+			self.segments = {}
+
+
+def rollback(fname, journalname):
+	# undo an interrupted OverlaySource.commit(). -> True if there was one
+	if not os.path.exists(journalname):
+		return False
+
+	with open(journalname, 'rb') as jf:
+		journal = jf.read()
+
+	if journal[:4] == journalmagic and len(journal) >= 12:
+		(basesize,) = struct.unpack_from(">Q", journal, 4)
+		with open(fname, 'r+b') as fp:
+			p = 12
+			while p + 16 <= len(journal):
+				(start, length) = struct.unpack_from(">QQ", journal, p)
+				p += 16
+				if p + length > len(journal):
+					break # journal itself was cut short, the file wasn't touched yet
+				fp.seek(start)
+				fp.write(journal[p : p+length])
+				p += length
+
+			fp.truncate(basesize)
+			fp.flush()
+			os.fsync(fp.fileno())
+
+	os.unlink(journalname)
+	return True
+
+
+class CachedSource(object):
+	# LRU cache of aligned blocks, for the many tiny reads parsers do.
+	# reads larger than a block go straight through.
+	def __init__(self, source, blocksize=2**16, cachesize=2**26):
+		assert blocksize % mmap.PAGESIZE == 0, "block size must be page-aligned"
+		self.source = source
+		self.fp = source.fp
+		self.blocksize = blocksize
+		self.cachesize = cachesize
+
+		self.lock = threading.Lock()
+		self.blocks = OrderedDict() # block index -> data, oldest first
+		self.cached = 0 # bytes
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.bypassed = 0
+
+	def close(self):
+		self.blocks.clear()
+		_close(self.source)
+
+	def __repr__(self):
+		return '<CachedSource %d x %d bytes, %d hits, %d misses, %d evictions, %d bypassed>' % (
+			len(self.blocks), self.blocksize,
+			self.hits, self.misses, self.evictions, self.bypassed)
+
+	def _block(self, index):
+		with self.lock:
+			data = self.blocks.get(index)
+			if data is not None:
+				self.hits += 1
+				self.blocks[index] = self.blocks.pop(index) # most recently used
+				return data
+
+			self.misses += 1
+
+		# outside the lock. two threads may fetch the same block, that's harmless.
+		data = self.source.read(index * self.blocksize, self.blocksize)
+
+		with self.lock:
+			if index not in self.blocks:
+				self.blocks[index] = data
+				self.cached += len(data)
+
+			while self.cached > self.cachesize and self.blocks:
+				(_, evicted) = self.blocks.popitem(last=False)
+				self.cached -= len(evicted)
+				self.evictions += 1
+
+		return data
+
+	def read(self, offset, nbytes):
+		if nbytes <= 0:
+			return ''
+
+		if nbytes > self.blocksize:
+			self.bypassed += 1
+			return self.source.read(offset, nbytes)
+
+		first = offset // self.blocksize
+		last = (offset + nbytes - 1) // self.blocksize
+
+		if first == last:
+			data = self._block(first)
+		else:
+			data = ''.join(self._block(i) for i in xrange(first, last+1))
+
+		skip = offset - first * self.blocksize
+		return data[skip : skip+nbytes]
+
+	def view(self, offset, nbytes):
+		return self.read(offset, nbytes)
+
+	def unpack(self, fmt, offset):
+		st = getstruct(fmt)
+		return st.unpack(self.read(offset, st.size))
+
+	def write(self, offset, data):
+		first = offset // self.blocksize
+		last = (offset + len(data) - 1) // self.blocksize
+		with self.lock:
+			for i in xrange(first, last+1):
+				evicted = self.blocks.pop(i, None)
+				if evicted is not None:
+					self.cached -= len(evicted)
+
+		self.source.write(offset, data)
+
+# ======================================================================
+
+
+class BufferCursor(object):
+	# forward reader over a Buffer, for field-by-field parsing.
+	# reads a window at a time and unpacks fields out of that.
+	def __init__(self, buf, pos=0, window=2**16):
+		self.buf = buf
+		self.pos = pos
+		self.window = window
+
+		self.data = ''
+		self.datapos = 0 # where self.data starts, relative to buf
+
+	def __len__(self):
+		return len(self.buf)
+
+	len = property(lambda self: len(self.buf))
+
+	def __getitem__(self, key):
+		return self.buf[key]
+
+	def _fill(self, nbytes):
+		# makes [pos, pos+nbytes) available in self.data, returns offset into it
+		skip = self.pos - self.datapos
+		if 0 <= skip and skip + nbytes <= len(self.data):
+			return skip
+
+		nbytes = max(nbytes, min(self.window, len(self.buf) - self.pos))
+		self.data = self.buf.source.read(self.buf.start + self.pos, nbytes)
+		self.datapos = self.pos
+		return 0
+
+	def __rshift__(self, fmt):
+		st = getstruct(fmt)
+		assert self.pos + st.size <= len(self.buf)
+		skip = self._fill(st.size)
+		res = st.unpack_from(self.data, skip)
+		self.pos += st.size
+		return res[0] if len(res) == 1 else res
+
+	def read(self, nbytes=None):
+		if nbytes is None:
+			nbytes = len(self.buf) - self.pos
+		else:
+			nbytes = min(nbytes, len(self.buf) - self.pos)
+
+		assert nbytes >= 0
+
+		if nbytes > self.window:
+			result = self.buf[self.pos : self.pos + nbytes].str()
+		else:
+			skip = self._fill(nbytes)
+			result = self.data[skip : skip+nbytes]
+
+		self.pos += nbytes
+		return result
+
+	def skip(self, nbytes):
+		assert self.pos + nbytes <= len(self.buf)
+		self.pos += nbytes
+
 
 class BufferReader(object):
 	def __init__(self, bufobj):
@@ -38,8 +991,9 @@ class BufferReader(object):
 
 
 class Buffer(object):
-	def __init__(self, fp, range):
+	def __init__(self, fp, range, source=None):
 		self.fp = fp
+		self.source = source or FileSource(fp)
 		self.pos = 0
 		start, stop, step = range.start, range.stop, range.step
 		start = (start or 0)
@@ -62,6 +1016,18 @@ class Buffer(object):
 	start = property(lambda self: self.slice.start)
 	stop = property(lambda self: self.slice.start + len(self))
 	
+	def has(self, offset):
+		# does the buffer extend to offset? (streams read ahead to find out)
+		return offset < len(self)
+
+	def sized(self):
+		# is len() known without reading to the end? (streams: once ended)
+		return True
+
+	def known_len(self):
+		# length as far as known without reading on (streams: read so far)
+		return len(self)
+
 	def reset(self):
 		self.pos = 0
 
@@ -80,21 +1046,42 @@ class Buffer(object):
 
 		return result
 
+	def as_array(self, dtype, count=None):
+		# numpy array over the bytes at pos; a view into the map on mapped
+		# files, else over the one string read. read-only either way.
+		import numpy as np
+
+		dtype = np.dtype(dtype)
+		if count is None:
+			count = (len(self) - self.pos) // dtype.itemsize
+
+		nbytes = count * dtype.itemsize
+		assert self.pos + nbytes <= len(self)
+
+		result = np.frombuffer(self.source.view(self.start + self.pos, nbytes), dtype=dtype, count=count)
+		self.pos += nbytes
+
+		return result
+
 	def write(self, data):
 		nbytes = len(data)
 		assert self.pos + nbytes <= len(self)
 
-		self.fp.seek(self.start + self.pos)
-		self.fp.write(data)
+		self.source.write(self.start + self.pos, data)
 		self.pos += nbytes
 
 	def str(self):
-		self.fp.seek(self.slice.start)
 		width = self.slice.stop - self.slice.start
 		assert(width >= 0)
-		res = self.fp.read(width)
+		res = self.source.read(self.slice.start, width)
 		return res
 
+	# zero-copy on mapped files, a plain string otherwise
+	def view(self):
+		width = self.slice.stop - self.slice.start
+		assert(width >= 0)
+		return self.source.view(self.slice.start, width)
+
 	def szstr(self):
 		result = self.str()
 		try:
@@ -123,22 +1110,43 @@ class Buffer(object):
 			i += 1
 	
 	def __rshift__(self, fmt):
-		fmtlen = struct.calcsize(fmt)
+		fmtlen = getstruct(fmt).size
 		assert self.pos + fmtlen <= len(self)
-		res = self[self.pos:][fmt]
+		res = self.source.unpack(fmt, self.slice.start + self.pos)
 		self.pos += fmtlen
-		return res
+		return res[0] if len(res) == 1 else res
 
 	def copy(self):
 		return self[:]
 
+	def commit(self):
+		# journaled files (FileBuffer(..., journal=True)): write out all patches
+		self.source.commit()
+
+	def close(self):
+		# stops prefetching, closes the file(s). slices share all of that
+		# with the buffer they came from, close only that one. the buffer is
+		# unusable after, but arrays from as_array() (views into the map on
+		# mapped files) stay valid; the map goes when the last of them does
+		_close(self.source)
+		self.fp.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def cursor(self, window=2**16):
+		return BufferCursor(self, self.pos, window)
+
 	def __getitem__(self, key):
 		width = self.slice.stop - self.slice.start
 
 		if isinstance(key, str):
-			fmtlen = struct.calcsize(key)
+			fmtlen = getstruct(key).size
 			assert fmtlen <= len(self)
-			rv = struct.unpack(key, self[:fmtlen].str())
+			rv = self.source.unpack(key, self.slice.start)
 			return rv[0] if len(rv) == 1 else rv
 
 		elif isinstance(key, slice):
@@ -168,7 +1176,7 @@ class Buffer(object):
 				self.slice.start + start,
 				self.slice.start + stop,
 				None
-			))
+			), self.source)
 		
 		else:
 			# wrap-around behavior
@@ -178,8 +1186,7 @@ class Buffer(object):
 			# bounds check
 			assert 0 <= key < self.length()
 
-			self.fp.seek(self.slice.start + key)
-			return self.fp.read(1)
+			return self.source.read(self.slice.start + key, 1)
 
 	def __setitem__(self, key, newval):
 		width = self.slice.stop - self.slice.start
@@ -192,8 +1199,7 @@ class Buffer(object):
 			
 			assert len(formatted) <= len(self)
 			
-			self.fp.seek(self.start)
-			self.fp.write(formatted)
+			self.source.write(self.start, formatted)
 			
 		elif isinstance(key, slice):
 			kstart = key.start
@@ -221,8 +1227,7 @@ class Buffer(object):
 				newval = str(newval)
 			assert len(newval) == stop-start
 			
-			self.fp.seek(self.slice.start + start)
-			self.fp.write(newval)
+			self.source.write(self.slice.start + start, newval)
 		
 		else:
 			assert isinstance(newval, str)
@@ -233,5 +1238,82 @@ class Buffer(object):
 			
 			assert 0 <= key < self.length()
 			
-			self.fp.seek(self.slice.start + key)
-			self.fp.write(newval)
+			self.source.write(self.slice.start + key, newval)
+
+
+class StreamBuffer(Buffer):
+	# open-ended buffer over a StreamSource. the length is only known once
+	# the stream has ended, so len() reads to the end; use has(), sized()
+	# and known_len() instead.
+	# slices with a stop are plain Buffers and are not checked against
+	# the end of the stream until it has been seen.
+	def __init__(self, fp, start, source):
+		self.fp = fp
+		self.source = source
+		self.pos = 0
+		self.slice = slice(start, None, None)
+
+	def __len__(self):
+		return self.source.fill() - self.slice.start
+
+	stop = property(lambda self: self.source.fill())
+
+	def has(self, offset):
+		offset += self.slice.start
+		return self.source.fill(offset + 1) > offset
+
+	def sized(self):
+		return self.source.eof
+
+	def known_len(self):
+		return self.source.size - self.slice.start
+
+	def str(self):
+		return self.source.read(self.slice.start, len(self))
+
+	def view(self):
+		return self.str()
+
+	def __str__(self):
+		return "StreamBuffer[%d:]" % self.slice.start
+
+	def __repr__(self):
+		return '<StreamBuffer [%d:], %d bytes read>' % (self.slice.start, self.source.size)
+
+	def __rshift__(self, fmt):
+		res = self[self.pos:][fmt]
+		self.pos += getstruct(fmt).size
+		return res
+
+	def __getitem__(self, key):
+		if isinstance(key, str):
+			return self[:getstruct(key).size][key]
+
+		elif isinstance(key, slice):
+			assert (not key.step) or (key.step == 1)
+			kstart = key.start or 0
+			assert kstart >= 0, "no negative indices on streams"
+
+			if key.stop is None:
+				return StreamBuffer(self.fp, self.slice.start + kstart, self.source)
+
+			kstop = key.stop
+			assert kstop >= 0, "no negative indices on streams"
+
+			if self.source.eof:
+				kstop = min(kstop, self.source.size - self.slice.start)
+
+			kstart = min(kstart, kstop)
+
+			return Buffer(self.fp, slice(
+				self.slice.start + kstart,
+				self.slice.start + kstop,
+				None
+			), self.source)
+
+		else:
+			assert self.has(key)
+			return self[key:key+1][0]
+
+	def __setitem__(self, key, newval):
+		assert False, "streams are read-only"
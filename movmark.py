@@ -86,7 +86,8 @@ if __name__ == '__main__':
 	# parse, check box positions
 
 	# open output file
-	filebuf = mp4check.FileBuffer(movfname, 'r+b')
+	# patches are collected and committed at the end, with an undo journal
+	filebuf = mp4check.FileBuffer(movfname, 'r+b', journal=True)
 	root = mp4check.parse(filebuf)
 	
 	# locate moov
@@ -201,7 +202,7 @@ if __name__ == '__main__':
 	# patch XMP_ length
 	xmpbox.buf[">I"] += delta
 
-	filebuf.fp.seek(xmpbuf.start)
-	filebuf.fp.write(xmpdata)
+	# may run past the old end of file
+	filebuf.source.write(xmpbuf.start, xmpdata)
 
-	filebuf.fp.flush()
+	filebuf.commit()
@@ -215,7 +215,7 @@ def thorough_scan(info, file, skip, stride, with_timecode, max_dtc=1000000):
 
 	# scan
 	i = 0
-	while state.p < file.len:
+	while file.has(state.p):
 		i += 1
 		if sys.stderr.isatty() and (i % 10000 == 0):
 			sys.stderr.write("scanning @%d (%6.2f %sB)...\r" % ((state.p,) + metric(state.p))); sys.stderr.flush()
@@ -388,8 +388,12 @@ if __name__ == '__main__':
 	stride = None
 	with_timecode = False
 	skip = 0
+	blocksize = None
+	chain = False
+	dontneed = False
+	iostats = False
 	
-	opts, args = getopt.gnu_getopt(sys.argv[1:], '', ['thorough', 'stride=', 'with_timecode=', 'skip=', 'nostatus'])
+	opts, args = getopt.gnu_getopt(sys.argv[1:], '', ['thorough', 'stride=', 'with_timecode=', 'skip=', 'nostatus', 'blocksize=', 'chain', 'dontneed', 'io-stats'])
 	for o,a in opts:
 		if o == '--thorough':
 			thorough = True
@@ -402,17 +406,56 @@ if __name__ == '__main__':
 
 		if o == '--skip':
 			skip = int(a)
+
+		if o == '--blocksize':
+			blocksize = int(a)
+
+		if o == '--chain':
+			chain = True
+
+		if o == '--dontneed':
+			dontneed = True
+
+		if o == '--io-stats':
+			iostats = True
 	
+	# '-': scan a stream from stdin, e.g. piped from ffmpeg during ingest.
+	# a stream can't be sampled at random, so this is always a thorough scan.
+	if args == ['-']:
+		stats = IOStats() if iostats else None
+		fb = PipeBuffer(sys.stdin, stats=stats)
+		thorough_scan(None, fb, skip, stride or (192 if with_timecode else 188), with_timecode)
+		if stats:
+			print stats.report()
+		sys.exit(0)
+
 	fnames = []
 	for globbable in args:
 		fnames += glob.glob(globbable)
 
-	for fname in fnames:
-		assert os.path.isfile(fname)
+	# --chain: check split recordings (foo.MTS, foo-1.MTS, ...) as one stream
+	if chain:
+		fnames.sort(key=natsortkey)
+		groups = [fnames]
+	else:
+		groups = [[fname] for fname in fnames]
+
+	for group in groups:
+		fname = group[0]
+		assert all(os.path.isfile(f) for f in group)
 
-		print fname
+		print ' + '.join(group)
 
-		fb = FileBuffer(fname)
+		# thorough scans read everything in order
+		stats = IOStats() if iostats else None
+		bufargs = {'prefetch': thorough, 'dontneed': dontneed, 'stats': stats}
+		if blocksize:
+			bufargs.update(cache=True, blocksize=blocksize)
+
+		if len(group) > 1:
+			fb = ChainBuffer(group, **bufargs)
+		else:
+			fb = FileBuffer(fname, **bufargs)
 		
 		this_camtype = camtype.get_type(fname)
 		
@@ -437,6 +480,14 @@ if __name__ == '__main__':
 		if (status == 0):
 			pp(info)
 
+		if blocksize:
+			print fb.source
+
+		if stats:
+			print stats.report()
+
+		fb.close() # and its prefetch thread
+
 		print "file looks", statuses[status]
 
 		# clean up previous statuses
@@ -453,6 +504,9 @@ if __name__ == '__main__':
 			try:
 				with open(x, 'w') as fh:
 					fh.write("camera type: " + this_camtype + "\n")
+
+					if len(group) > 1:
+						fh.write("chained: " + ' + '.join(map(os.path.basename, group)) + "\n")
 					
 					if info:
 						fh.write(pprint.pformat(info))
@@ -465,5 +519,5 @@ if __name__ == '__main__':
 
 		print
 
-		if len(fnames) == 1:
+		if len(groups) == 1:
 			sys.exit(status)
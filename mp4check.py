@@ -2,11 +2,16 @@
 
 from __future__ import with_statement
 import os, sys
+import errno
 import struct
 import pprint; pp = pprint.pprint
 import glob
 import ctypes
 import time, datetime, calendar
+import mmap
+import json
+import stat
+import tempfile
 import numpy as np
 from funcs import *
 from filetools import *
@@ -62,59 +67,38 @@ def blockindent(n, text):
 	)
 
 class Atom(object):
-	def __init__(self, start, length, type, content=None, buf=None):
+	def __init__(self, start, length, type, content=None, buf=None, loader=None):
 		self.start   = start
 		self.length  = length
 		self.type    = type
-		self.content = content
+		self._content = content
 		self.buf     = buf
-	
-	def __repr__(self, indent=0, index=0):
-		label = self.type if all(32 <= ord(c) < 128 for c in self.type) else repr(self.type)
-		
-		sublabel = ''
-		
-		if (self.content is not None) and isinstance(self.content, list):
-			sublabel = ' // %d children...' % len(self.content)
-		
-		res = [lineindent(indent) + '[%d] %s  [@%d + %d]%s' % (
-			index+1,
-			label,
-			self.start,
-			self.length,
-			sublabel
-		)]
-		
-		if self.content is not None:
-			multiline = False
-			
-			if isinstance(self.content, list):
-				multiline = True
-			elif '\n' in repr(self.content):
-				multiline = True
-			
-			if multiline:
-				res.append('\n')
-				res.append(lineindent(indent) + '{\n')
+		self.loader  = loader # (handler, args), for lazy trees: run on first access
 
-				if isinstance(self.content, list):
-					for i,item in enumerate(self.content):
-						if isinstance(item, Atom):
-							res.append(item.__repr__(indent+1, index=i))
-						else:
-							res.append(blockindent(indent+1, ('[%d] ' % (i+1)) + repr(item) + "\n"))
-				else:
-					res.append(blockindent(indent+1, repr(self.content) + '\n'))
-
-				res.append(lineindent(indent) + '}\n')
+	@property
+	def content(self):
+		if self.loader is not None:
+			(fn, args) = self.loader
 
+			if fn in containers: # containers stay lazy
+				newcontent = fn(*args, lazy=True)
 			else:
-				res.append(' { ')
-				res.append(repr(self.content))
-				res.append(' }\n')
-			
-		
-		return ''.join(res)
+				newcontent = fn(*args)
+
+			# only now: if the handler raised, the next access raises again
+			self.loader = None
+			if newcontent is not None:
+				self._content = newcontent
+
+		return self._content
+
+	@content.setter
+	def content(self, value):
+		self.loader = None
+		self._content = value
+	
+	def __repr__(self, indent=0, index=0):
+		return ''.join(line + '\n' for line in report_atom(self, indent, index))
 
 # ======================================================================
 
@@ -129,6 +113,144 @@ class abbrevlist(list):
 			
 		return '[%s]' % inner
 
+# ======================================================================
+# report: the tree as text, a line at a time, so it can go straight to a file.
+# long arrays and lists are cut down to their ends and some statistics
+
+reportitems = 4 # elements shown at either end of long arrays/lists
+
+def summarize(array):
+	# one line for a numpy array of any length
+	if array.ndim > 1:
+		columns = [('[%d]' % i, array[:,i]) for i in xrange(array.shape[1])]
+	elif array.dtype.names:
+		columns = [(name, array[name]) for name in array.dtype.names]
+	else:
+		columns = [(None, array)]
+
+	if len(array) <= 2*reportitems:
+		return 'array(%r)' % (_plain(array.tolist()),)
+
+	stats = []
+	for (name, column) in columns:
+		if column.dtype.kind not in 'biuf' or column.ndim > 1:
+			continue
+		column = column.astype(np.int64 if column.dtype.kind in 'biu' else np.float64)
+		stats.append('%smin %s, max %s, sum %s' % (
+			'' if (name is None) else (name + ': '),
+			column.min(), column.max(), column.sum()))
+
+	return 'array(%d x %s%s: %s, ..., %s)' % (
+		len(array),
+		array.dtype.str if (not array.dtype.names) else 'record',
+		''.join('; ' + stat for stat in stats),
+		', '.join(repr(_plain(item)) for item in array[:reportitems].tolist()),
+		', '.join(repr(_plain(item)) for item in array[-reportitems:].tolist()))
+
+def _plain(value):
+	# uint32 elements come back as longs; no 'L' in the report
+	if isinstance(value, long) and -sys.maxint-1 <= value <= sys.maxint:
+		return int(value)
+	elif isinstance(value, tuple):
+		return tuple(map(_plain, value))
+	elif isinstance(value, list):
+		return map(_plain, value)
+	return value
+
+def _is_simple(value):
+	return not isinstance(value, (Atom, np.ndarray, dict, list))
+
+def _is_inline(value):
+	# reported on one line
+	return _is_simple(value) or isinstance(value, np.ndarray) or (
+		isinstance(value, list) and all(_is_simple(item) for item in value))
+
+def report_value(value, indent=0):
+	# lines for a handler result
+	if isinstance(value, np.ndarray):
+		yield lineindent(indent) + summarize(value)
+
+	elif isinstance(value, dict):
+		keys = sorted(value)
+		width = max([len(str(key)) for key in keys]) if keys else 0
+
+		yield lineindent(indent) + value.__class__.__name__ + '('
+		for key in keys:
+			item = value[key]
+			if _is_inline(item):
+				first = report_value(item).next()
+				yield '%s%-*s = %s' % (lineindent(indent+1), width, key, first)
+			else:
+				yield '%s%s =' % (lineindent(indent+1), key)
+				for line in report_value(item, indent+2):
+					yield line
+		yield lineindent(indent) + ')'
+
+	elif isinstance(value, list):
+		if all(_is_simple(item) for item in value):
+			yield lineindent(indent) + repr(abbrevlist(value))
+			return
+
+		yield lineindent(indent) + '['
+		for (i, item) in enumerate(value):
+			if len(value) > 2*reportitems and i == reportitems:
+				yield lineindent(indent+1) + '... (%d total) ...' % len(value)
+			if len(value) > 2*reportitems and reportitems <= i < len(value) - reportitems:
+				continue
+
+			if isinstance(item, Atom):
+				for line in report_atom(item, indent+1, i):
+					yield line
+			else:
+				for line in report_value(item, indent+1):
+					yield line
+		yield lineindent(indent) + ']'
+
+	else:
+		for line in repr(value).split('\n'):
+			yield lineindent(indent) + line
+
+def report_atom(atom, indent=0, index=0):
+	# lines for an atom and everything under it
+	label = atom.type if all(32 <= ord(c) < 128 for c in atom.type) else repr(atom.type)
+	content = atom.content
+
+	head = lineindent(indent) + '[%d] %s  [@%d + %d]' % (index+1, label, atom.start, atom.length)
+
+	if content is None:
+		yield head
+
+	elif isinstance(content, list):
+		yield head + ' // %d children...' % len(content)
+		yield lineindent(indent) + '{'
+		for (i, item) in enumerate(content):
+			if isinstance(item, Atom):
+				for line in report_atom(item, indent+1, i):
+					yield line
+			else:
+				lines = report_value(item, indent+1)
+				yield lineindent(indent+1) + ('[%d] ' % (i+1)) + lines.next().lstrip()
+				for line in lines:
+					yield line
+		yield lineindent(indent) + '}'
+
+	else:
+		lines = list(report_value(content)) if _is_inline(content) else None
+		if lines is not None and len(lines) == 1:
+			yield head + ' { ' + lines[0] + ' }'
+		else:
+			yield head
+			yield lineindent(indent) + '{'
+			for line in (lines or report_value(content, indent+1)):
+				yield (lineindent(indent+1) + line) if (lines is not None) else line
+			yield lineindent(indent) + '}'
+
+def write_report(fh, atoms):
+	for (i, atom) in enumerate(atoms):
+		for line in report_atom(atom, 0, i):
+			fh.write(line)
+			fh.write('\n')
+
 # ======================================================================
 
 handlers = {}
@@ -166,17 +288,18 @@ def parse_elst(type, offset, content, path):
 	version = (content >> ">B")
 	flags   = (content >> ">3B")
 	count   = (content >> ">I")
-	assert version == 0
+	assert version in (0, 1)
 	assert flags == (0,0,0)
 
-	assert content.pos + 12*count == content.len
+	width = 4 * (version+1) # duration and start: 32 or 64 bit
+	assert content.pos + (2*width+4)*count == content.len
 
-	entries = np.fromstring(content.read(), dtype='>i4,>i4,>i4'
+	entries = content.as_array('>i%d,>i%d,>i4' % (width, width)
 		#[('duration', '>i4'), ('start', '>i4'), ('rate', '>i4')]
 	)#.astype('i4,i4,f4')
 
 	entries = [
-		{'duration': duration, 'start': start, 'rate': rate / 2**16}
+		{'duration': duration, 'start': start, 'rate': rate / 65536.0}
 		for (duration, start, rate) in entries
 	]
 	#entries['f2'] /= 2**16
@@ -248,6 +371,8 @@ def parse_mvhd(type, blockoffset, content, path):
 
 @handler('tkhd')
 def parse_tkhd(type, offset, content, path):
+	content = content.cursor()
+
 	version = (content >> ">B")
 	flags = byteint(content >> ">BBB")
 	flags = Record(
@@ -302,6 +427,7 @@ def parse_tkhd(type, offset, content, path):
 @handler('mdhd')
 def parse_mdhd(type, offset, content, path):
 	# http://wiki.multimedia.cx/index.php?title=QuickTime_container#mdhd
+	content = content.cursor()
 	
 	version = (content >> ">B")
 	flags   = (content >> ">BBB")
@@ -329,6 +455,7 @@ def parse_mdhd(type, offset, content, path):
 @handler('dref')
 def handle_dref(type, offset, content, path):
 	# https://developer.apple.com/library/mac/documentation/QuickTime/QTFF/QTFFChap2/qtff2.html
+	content = content.cursor()
 	version = (content >> ">B")
 	flags = (content >> ">BBB")
 	numentries = (content >> ">I")
@@ -375,6 +502,7 @@ def byteint(values):
 @handler('stsd')
 def parse_stsd(type, offset, content, path):
 	# https://developer.apple.com/library/mac/documentation/QuickTime/QTFF/QTFFChap2/qtff2.html
+	content = content.cursor()
 
 	version = nibbles(content >> ">B", 2)
 	flags = byteint(content >> ">BBB")
@@ -386,8 +514,8 @@ def parse_stsd(type, offset, content, path):
 		start = content.pos
 		descrlen = (content >> ">I")
 		descrformat = (content >> ">4s")
-		data = content[content.pos:start+descrlen]
-		content.pos += descrlen
+		data = content[content.pos:start+descrlen].cursor()
+		content.pos = start + descrlen
 
 		# https://developer.apple.com/library/content/documentation/QuickTime/QTFF/QTFFChap2/qtff2.html#//apple_ref/doc/uid/TP40000939-CH204-61112
 		reserved = (data >> ">6B")
@@ -405,7 +533,7 @@ def parse_stsd(type, offset, content, path):
 		)
 		descriptions.append(record)
 
-		if descrformat in ('rle ',): # 'mp4v', 'avc1', 'encv', 's263'):
+		if descrformat in ('rle ', 'avc1', 'avc3', 'hvc1', 'hev1'): # 'mp4v', 'encv', 's263'):
 			(
 				record.quality_temporal,
 				record.quality_spatial
@@ -436,8 +564,26 @@ def parse_stsd(type, offset, content, path):
 			colortableid = (data >> ">h")
 			assert colortableid == -1
 
-			if data.read(8) == '\x00\x00\x00\x0Afiel':
-				record.fields = (data >> ">BB")
+			if descrformat == 'rle ':
+				if data.read(8) == '\x00\x00\x00\x0Afiel':
+					record.fields = (data >> ">BB")
+
+			else:
+				# codec configuration (avcC, hvcC) and other atoms (btrt, pasp, ...)
+				while data.pos + 8 <= data.len:
+					boxstart = data.pos
+					(boxsize, boxtype) = (data >> ">I4s")
+					if not (8 <= boxsize <= data.len - boxstart):
+						data.pos = boxstart
+						break
+
+					body = data[data.pos:boxstart+boxsize]
+					data.pos = boxstart + boxsize
+
+					if boxtype in ('avcC', 'hvcC'):
+						record[boxtype] = handlers[boxtype](boxtype, body.start, body, path + [boxtype])
+					else:
+						record[boxtype] = body
 
 		elif descrformat in ('mp4a',): # 'enca', 'samr', 'sawb'):
 			pass
@@ -495,10 +641,87 @@ def parse_stsd(type, offset, content, path):
 	return descriptions
 
 
+@handler('avcC')
+def parse_avcC(type, offset, content, path):
+	# ISO 14496-15 5.3.3.1, AVCDecoderConfigurationRecord
+	content = content.cursor()
+
+	(version, profile, compatibility, level, lengthsize) = (content >> ">5B")
+	record = Record(
+		version = version,
+		profile = profile,
+		compatibility = compatibility,
+		level = level,
+		lengthsize = (lengthsize & 3) + 1,
+	)
+
+	record.sps = [content.read(content >> ">H") for i in xrange((content >> ">B") & 0x1F)]
+	record.pps = [content.read(content >> ">H") for i in xrange(content >> ">B")]
+
+	# high profiles (not always written)
+	if profile not in (66, 77, 88) and content.pos + 4 <= content.len:
+		record.chroma_format = (content >> ">B") & 3
+		record.bitdepth = (((content >> ">B") & 7) + 8, ((content >> ">B") & 7) + 8)
+		record.spsext = [content.read(content >> ">H") for i in xrange(content >> ">B")]
+
+	return record
+
+@handler('hvcC')
+def parse_hvcC(type, offset, content, path):
+	# ISO 14496-15 8.3.3.1, HEVCDecoderConfigurationRecord
+	content = content.cursor()
+
+	version = (content >> ">B")
+	byte = (content >> ">B")
+	record = Record(
+		version = version,
+		profile_space = byte >> 6,
+		tier = (byte >> 5) & 1,
+		profile = byte & 0x1F,
+		compatibility = (content >> ">I"),
+		constraints = byteint(content >> ">6B"),
+		level = (content >> ">B"),
+	)
+
+	content.skip(3) # min_spatial_segmentation_idc, parallelismType
+	record.chroma_format = (content >> ">B") & 3
+	record.bitdepth = (((content >> ">B") & 7) + 8, ((content >> ">B") & 7) + 8)
+	record.framerate = (content >> ">H") / 256.0 # 0: unspecified
+
+	byte = (content >> ">B")
+	record.temporal_layers = (byte >> 3) & 7
+	record.lengthsize = (byte & 3) + 1
+
+	# parameter sets (VPS, SPS, PPS, SEI), by NAL unit type
+	record.arrays = []
+	for i in xrange(content >> ">B"):
+		byte = (content >> ">B")
+		record.arrays.append(Record(
+			type = byte & 0x3F,
+			complete = bool(byte & 0x80),
+			units = [content.read(content >> ">H") for j in xrange(content >> ">H")],
+		))
+
+	return record
+
 @handler('co64')
 def parse_co64(type, offset, content, path):
-	return content
 	# http://wiki.multimedia.cx/index.php?title=QuickTime_container#co64
+	# like stco, with 64-bit offsets
+	
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	count   = (content >> '>I')
+
+	assert flags == (0,0,0)
+	
+	offsets = content.as_array('>u8')
+	assert (len(offsets) == count)
+	
+	return Record(
+		version = version,
+		offsets = offsets
+	)
 
 @handler('stco')
 def parse_stco(type, offset, content, path):
@@ -514,7 +737,7 @@ def parse_stco(type, offset, content, path):
 
 	assert flags == (0,0,0)
 	
-	offsets = np.fromstring(content.read(), dtype=np.uint32).byteswap()
+	offsets = content.as_array('>u4')
 	assert (len(offsets) == count)
 	
 	return Record(
@@ -523,6 +746,54 @@ def parse_stco(type, offset, content, path):
 	)
 
 
+@handler('stsc')
+def parse_stsc(type, offset, content, path):
+	# http://wiki.multimedia.cx/index.php?title=QuickTime_container#stsc
+	# runs of chunks: a run lasts until the next entry's first chunk
+	
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	count   = (content >> '>I')
+
+	assert flags == (0,0,0)
+
+	entries = content.as_array([('first', '>u4'), ('samples', '>u4'), ('description', '>u4')])
+	assert (len(entries) == count)
+
+	return Record(
+		version = version,
+		entries = entries
+	)
+
+def stsc_expand(entries, nchunks):
+	# samples in each of nchunks chunks
+	firsts = entries['first'].astype(np.int64) - 1
+	runs = np.diff(np.append(firsts, nchunks))
+	assert (runs >= 0).all()
+	return np.repeat(entries['samples'].astype(np.int64), runs)
+
+
+@handler('ctts')
+def parse_ctts(type, offset, content, path):
+	# http://wiki.multimedia.cx/index.php?title=QuickTime_container#ctts
+	# (count, offset) runs. offsets are signed in practice, even for version 0
+	
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	count   = (content >> '>I')
+
+	assert version in (0, 1)
+	assert flags == (0,0,0)
+
+	entries = content.as_array([('count', '>u4'), ('offset', '>i4')])
+	assert (len(entries) == count)
+
+	return Record(
+		version = version,
+		entries = entries
+	)
+
+
 @handler('stss')
 def parse_stss(type, offset, content, path):
 	# http://wiki.multimedia.cx/index.php?title=QuickTime_container#stss
@@ -535,7 +806,7 @@ def parse_stss(type, offset, content, path):
 	
 	assert content.pos + 4*count == content.len
 
-	chunks = np.fromstring(content.read(), dtype=np.uint32).byteswap()
+	chunks = content.as_array('>u4')
 	assert (len(chunks) == count)
 	
 	return Record(
@@ -555,7 +826,7 @@ def parse_stss(type, offset, content, path):
 	assert flags == (0,0,0)
 
 	# (count,duration) tuples
-	entries = np.fromstring(content.read(), dtype=np.uint32).byteswap().reshape((-1, 2))
+	entries = content.as_array('>u4').reshape((-1, 2))
 	assert len(entries) == count
 
 	return entries
@@ -573,7 +844,7 @@ def parse_stsz(type, offset, content, path):
 	assert flags == (0,0,0)
 
 	if samplesize == 0: # different sizes
-		sizes = np.fromstring(content.read(), dtype=np.uint32).byteswap()
+		sizes = content.as_array('>u4')
 		assert(len(sizes) == count)
 
 	else: # all same size
@@ -582,6 +853,7 @@ def parse_stsz(type, offset, content, path):
 	return Record(
 		version = version,
 		samplesize = samplesize,
+		count = count,
 		sizes = sizes
 	)
 
@@ -633,14 +905,14 @@ def parse_vmhd(type, offset, content, path):
 	)
 
 @handler('meta')
-def parse_meta(type, offset, content, path):
+def parse_meta(type, offset, content, path, lazy=False):
 	if path == 'moov.udta.meta'.split('.'):
 		assert content.fp.name.endswith('.mp4') # should happen in MP4 files only
 		assert content[0:4].str() == '\x00'*4
-		return parse_sequence(type, offset+4, content[4:], path)
+		return parse_sequence(type, offset+4, content[4:], path, lazy=lazy)
 	else:
 		# anything else: just a container
-		return parse_sequence(type, offset, content, path)
+		return parse_sequence(type, offset, content, path, lazy=lazy)
 
 @handler('hdlr')
 def parse_hdlr(type, offset, content, path):
@@ -693,8 +965,8 @@ def parse_keys(type, offset, content, path):
 	)
 
 @handler('ilst')
-def parse_ilst(type, offset, content, path):
-	return parse_sequence(type, offset, content, path)
+def parse_ilst(type, offset, content, path, lazy=False):
+	return parse_sequence(type, offset, content, path, lazy=lazy)
 
 # TODO: do this right
 def parse_ilst(type, offset, content, path):
@@ -788,8 +1060,200 @@ def parse_uuid(type, blockoffset, content, path):
 	
 	return result
 
-@handler(None, 'moov', 'trak', 'edts', 'mdia', 'dinf', 'minf', 'stbl', 'udta', 'TSCM')
-def parse_sequence(type, blockoffset, block, path=[], use_handler=True):
+# ======================================================================
+# fragmented files
+
+@handler('trex')
+def parse_trex(type, offset, content, path):
+	# sample defaults for fragments, per track
+	content = content.cursor()
+
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	(track_id, description, duration, size, sampleflags) = (content >> '>IIIII')
+
+	return Record(
+		version = version,
+		track_id = track_id,
+		description = description,
+		duration = duration,
+		size = size,
+		flags = sampleflags
+	)
+
+@handler('mehd')
+def parse_mehd(type, offset, content, path):
+	content = content.cursor()
+
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	duration = (content >> (">Q" if (version == 1) else ">I"))
+
+	return Record(
+		version = version,
+		duration = duration
+	)
+
+@handler('mfhd')
+def parse_mfhd(type, offset, content, path):
+	content = content.cursor()
+
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	sequence = (content >> '>I')
+
+	return Record(
+		version = version,
+		sequence = sequence
+	)
+
+@handler('tfhd')
+def parse_tfhd(type, offset, content, path):
+	# fields are present according to flags. absent ones are None (-> trex)
+	content = content.cursor()
+
+	version = (content >> '>B')
+	flags   = byteint(content >> '>BBB')
+	track_id = (content >> '>I')
+
+	def field(bit, fmt):
+		return (content >> fmt) if (flags & bit) else None
+
+	base_offset = field(0x01, '>Q')
+	description = field(0x02, '>I')
+	duration    = field(0x08, '>I')
+	size        = field(0x10, '>I')
+	sampleflags = field(0x20, '>I')
+
+	return Record(
+		version = version,
+		track_id = track_id,
+		base_offset = base_offset,
+		description = description,
+		duration = duration,
+		size = size,
+		flags = sampleflags,
+		empty = bool(flags & 0x10000),
+		base_is_moof = bool(flags & 0x20000)
+	)
+
+@handler('tfdt')
+def parse_tfdt(type, offset, content, path):
+	content = content.cursor()
+
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	time    = (content >> (">Q" if (version == 1) else ">I"))
+
+	return Record(
+		version = version,
+		time = time
+	)
+
+@handler('trun')
+def parse_trun(type, offset, content, path):
+	# per-sample fields present according to flags, read as one record array
+	version = (content >> '>B')
+	flags   = byteint(content >> '>BBB')
+	count   = (content >> '>I')
+
+	data_offset = (content >> '>i') if (flags & 0x01) else None
+	first_flags = (content >> '>I') if (flags & 0x04) else None
+
+	fields = [
+		(name, fmt)
+		for (bit, name, fmt) in [
+			(0x100, 'duration', '>u4'),
+			(0x200, 'size',     '>u4'),
+			(0x400, 'flags',    '>u4'),
+			(0x800, 'cto',      '>i4'), # unsigned in version 0, signed in practice
+		]
+		if flags & bit
+	]
+
+	samples = None
+	if fields:
+		samples = content.as_array(fields, count)
+
+	return Record(
+		version = version,
+		count = count,
+		data_offset = data_offset,
+		first_flags = first_flags,
+		samples = samples
+	)
+
+@handler('sidx')
+def parse_sidx(type, offset, content, path):
+	# segment index. offsets are absolute, counted from the end of this atom
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	(reference_id, timescale) = (content >> '>II')
+
+	if version == 0:
+		(earliest, first_offset) = (content >> '>II')
+	else:
+		(earliest, first_offset) = (content >> '>QQ')
+
+	(reserved, count) = (content >> '>HH')
+
+	entries = content.as_array([('size', '>u4'), ('duration', '>u4'), ('sap', '>u4')])
+	assert (len(entries) == count)
+
+	sizes = (entries['size'] & 0x7fffffff).astype(np.int64)
+	durations = entries['duration'].astype(np.int64)
+
+	return Record(
+		version = version,
+		reference_id = reference_id,
+		timescale = timescale,
+		earliest = earliest,
+		nested = (entries['size'] >> 31).astype(bool), # refers to another sidx
+		times = earliest + np.cumsum(durations) - durations,
+		offsets = (offset + content.len + first_offset) + np.cumsum(sizes) - sizes,
+		sizes = sizes
+	)
+
+@handler('tfra')
+def parse_tfra(type, offset, content, path):
+	# random access points of a track: (time, moof offset)
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	(track_id, lengths, count) = (content >> '>III')
+
+	wordsize = 8 if (version == 1) else 4
+	# traf, trun and sample numbers, 1..4 bytes each
+	numbersize = sum(((lengths >> shift) & 3) + 1 for shift in (4, 2, 0))
+
+	entries = content.as_array({
+		'names': ['time', 'moof'],
+		'formats': ['>u%d' % wordsize] * 2,
+		'offsets': [0, wordsize],
+		'itemsize': 2*wordsize + numbersize
+	}, count)
+
+	return Record(
+		version = version,
+		track_id = track_id,
+		times = entries['time'].astype(np.int64),
+		offsets = entries['moof'].astype(np.int64)
+	)
+
+@handler('mfro')
+def parse_mfro(type, offset, content, path):
+	content = content.cursor()
+
+	version = (content >> '>B')
+	flags   = (content >> '>BBB')
+	size    = (content >> '>I')
+
+	return Record(
+		version = version,
+		size = size
+	)
+
+@handler(None, 'moov', 'trak', 'edts', 'mdia', 'dinf', 'minf', 'stbl', 'udta', 'TSCM', 'mvex', 'moof', 'traf', 'mfra')
+def parse_sequence(type, blockoffset, block, path=[], use_handler=True, lazy=False):
 	start = 0
 	
 	res = []
@@ -826,28 +1290,32 @@ def parse_sequence(type, blockoffset, block, path=[], use_handler=True):
 			label = type if all(32 <= ord(c) < 128 for c in type) else repr(type)
 			print lineindent(len(path)) + "%s  [@%d + %d]" % (label, blockoffset+start, size)
 
-		newcontent = None		
+		fn = None
 
 		if use_handler is True:
-			if type in handlers:
-				newcontent = handlers[type](
-					type,
-					blockoffset+start+contentoffset,
-					content,
-					path+[type]
-				)
+			fn = handlers.get(type)
 		elif use_handler:
-			newcontent = use_handler(
-				type,
-				blockoffset+start+contentoffset,
-				content,
-				path+[type]
-			)
+			fn = use_handler
+
+		args = (
+			type,
+			blockoffset+start+contentoffset,
+			content,
+			path+[type]
+		)
+
+		if lazy and fn is not None:
+			# handler runs when .content is first looked at
+			item = Atom(blockoffset+start, size, type, content, buf=block[start:start+size], loader=(fn, args))
+
+		else:
+			newcontent = fn(*args) if (fn is not None) else None
+
+			if newcontent is not None:
+				content = newcontent
 
-		if newcontent is not None:
-			content = newcontent
+			item = Atom(blockoffset+start, size, type, content, buf=block[start:start+size])
 
-		item = Atom(blockoffset+start, size, type, content, buf=block[start:start+size])
 		res.append(item)
 
 		start += size
@@ -855,10 +1323,13 @@ def parse_sequence(type, blockoffset, block, path=[], use_handler=True):
 	assert start == block.len
 	
 	return res
-	
 
-def parse(buffer, offset=0):
-	return handlers[None](None, 0, buffer)
+# handlers that recurse, and take lazy= to stay lazy below
+containers = set([parse_sequence, parse_meta, handlers['ilst']])
+
+def parse(buffer, offset=0, lazy=False):
+	# lazy: children and handler results are computed on first access
+	return parse_sequence(None, 0, buffer, lazy=lazy)
 
 def select(data, path):
 	for edge in path:
@@ -873,6 +1344,954 @@ def select(data, path):
 	
 	return data
 
+# ======================================================================
+# per-track sample index
+
+class SampleIndex(object):
+	# columnar sample table of one track, times in the track's timescale.
+	# offset, size, dts, cts: int64 arrays; keyframe: bool array.
+	# lastdelta: duration of the last sample (stts, trun), None if unknown
+	def __init__(self, offset, size, dts, cts, keyframe, timescale, lastdelta=None):
+		self.offset    = offset
+		self.size      = size
+		self.dts       = dts
+		self.cts       = cts
+		self.keyframe  = keyframe
+		self.timescale = timescale
+		self.lastdelta = lastdelta
+
+		self.nal = None # NAL unit type bitmasks, from classify_nal_units
+
+		self._byoffset = None
+		self._keys = None
+
+	@classmethod
+	def from_trak(cls, trak):
+		timescale = select(trak, ['mdia', 'mdhd']).scale
+		stbl = dict((atom.type, atom) for atom in select(trak, ['mdia', 'minf', 'stbl']))
+
+		# sizes
+		stsz = stbl['stsz'].content
+		if stsz.sizes is not None:
+			size = stsz.sizes.astype(np.int64)
+		else:
+			size = np.empty(stsz.count, dtype=np.int64)
+			size.fill(stsz.samplesize)
+		count = len(size)
+
+		# chunk offsets
+		co = stbl['stco'] if ('stco' in stbl) else stbl['co64']
+		chunkoffsets = co.content.offsets.astype(np.int64)
+		nchunks = len(chunkoffsets)
+
+		perchunk = stsc_expand(stbl['stsc'].content.entries, nchunks)
+
+		# sample -> chunk, and position of the sample within its chunk
+		chunk = np.repeat(np.arange(nchunks), perchunk)[:count]
+		assert len(chunk) == count, "stsc describes fewer samples than stsz"
+
+		ends = np.cumsum(size)
+		starts = ends - size
+		chunkfirst = np.cumsum(perchunk) - perchunk
+		offset = chunkoffsets[chunk] + (starts - starts[chunkfirst[chunk]])
+
+		# decoding times from (count, delta) runs
+		stts = stbl['stts'].content
+		deltas = np.repeat(stts[:,1].astype(np.int64), stts[:,0])
+		assert len(deltas) == count, "stts describes %d samples, stsz %d" % (len(deltas), count)
+		dts = np.cumsum(deltas) - deltas
+
+		# composition offsets
+		if 'ctts' in stbl:
+			ctts = stbl['ctts'].content.entries
+			cts = dts + np.repeat(ctts['offset'].astype(np.int64), ctts['count'])
+		else:
+			cts = dts
+
+		# sync samples (1-based); without stss, every sample is one
+		if 'stss' in stbl:
+			keyframe = np.zeros(count, dtype=bool)
+			keyframe[stbl['stss'].content.chunks.astype(np.int64) - 1] = True
+		else:
+			keyframe = np.ones(count, dtype=bool)
+
+		return cls(offset, size, dts, cts, keyframe, timescale, int(deltas[-1]) if count else None)
+
+	@classmethod
+	def concatenate(cls, indexes):
+		# one index over several (fragments of the same track), in order
+		columns = [
+			np.concatenate([getattr(index, name) for index in indexes])
+			for name in ('offset', 'size', 'dts', 'cts', 'keyframe')
+		]
+		result = cls(*columns, timescale=indexes[0].timescale, lastdelta=indexes[-1].lastdelta)
+		if all(index.nal is not None for index in indexes):
+			result.nal = np.concatenate([index.nal for index in indexes])
+		return result
+
+	def __len__(self):
+		return len(self.offset)
+
+	@property
+	def duration(self):
+		# end of the last sample. without its own duration, it gets the one before's
+		if len(self) == 0:
+			return 0
+		if self.lastdelta is not None:
+			return int(self.dts[-1] + self.lastdelta)
+		return int(self.dts[-1] + (self.dts[-1] - self.dts[-2] if len(self) > 1 else 0))
+
+	def __repr__(self):
+		return '<SampleIndex %d samples, %d keyframes, %.3fs at %d/s>' % (
+			len(self), self.keyframe.sum(), self.duration / float(self.timescale), self.timescale)
+
+	def at_time(self, t):
+		# last sample decoded at or before t (timescale units), or None
+		i = np.searchsorted(self.dts, t, 'right') - 1
+		return int(i) if i >= 0 else None
+
+	def keyframe_at_time(self, t):
+		# last keyframe decoded at or before t, or None
+		if self._keys is None:
+			self._keys = np.flatnonzero(self.keyframe)
+		i = np.searchsorted(self.dts[self._keys], t, 'right') - 1
+		return int(self._keys[i]) if i >= 0 else None
+
+	def at_offset(self, pos):
+		# sample whose bytes contain file offset pos, or None
+		if self._byoffset is None:
+			order = np.argsort(self.offset, kind='mergesort')
+			self._byoffset = (order, self.offset[order])
+
+		(order, offsets) = self._byoffset
+		i = np.searchsorted(offsets, pos, 'right') - 1
+		if i < 0:
+			return None
+
+		i = order[i]
+		if pos < self.offset[i] + self.size[i]:
+			return int(i)
+		return None
+
+def sample_indexes(atoms):
+	# SampleIndex for each track in the tree, in order
+	return [
+		SampleIndex.from_trak(atom.content)
+		for atom in select(atoms, ['moov'])
+		if atom.type == 'trak'
+	]
+
+class Timeline(object):
+	# presentation time, media time and sample number of one track. the edit
+	# list (elst, movie timescale) maps presentation to media time, samples
+	# show from their cts (mdhd scale, ctts) on. times in seconds, functions
+	# take and give arrays. what doesn't map (empty edits, past the end) is
+	# nan, or sample -1
+	def __init__(self, samples, edits=None, movietimescale=None):
+		self.samples = samples
+		scale = float(samples.timescale)
+
+		if edits:
+			durations = np.array([edit['duration'] for edit in edits], dtype=np.float64) / movietimescale
+			self.mediastarts = np.array([edit['start'] for edit in edits], dtype=np.float64) / scale
+			self.rates = np.array([edit['rate'] for edit in edits], dtype=np.float64)
+			self.empty = np.array([edit['start'] == -1 for edit in edits], dtype=bool)
+			if durations[-1] == 0: # fragmented files: to the end, whatever comes
+				durations[-1] = np.inf
+		else:
+			durations = np.array([np.inf])
+			self.mediastarts = np.zeros(1)
+			self.rates = np.ones(1)
+			self.empty = np.zeros(1, dtype=bool)
+
+		self.starts = np.append([0.0], np.cumsum(durations[:-1]))
+		self.ends = self.starts + durations
+
+		# samples in presentation order
+		self.order = np.argsort(samples.cts, kind='mergesort')
+		self.ctsorted = samples.cts[self.order] / scale
+		self.mediaend = (samples.cts.max() + samples.duration - samples.dts[-1]) / scale if len(samples) else 0.0
+
+	@classmethod
+	def from_track(cls, track, movietimescale):
+		# track: from track_indexes
+		edts = [atom for atom in track.trak if atom.type == 'edts']
+		edits = None
+		if edts:
+			elst = [atom for atom in edts[0].content if atom.type == 'elst']
+			if elst:
+				edits = elst[0].content
+
+		timeline = cls(track.samples, edits, movietimescale)
+		timeline.track_id = track.track_id
+		timeline.handler = track.handler
+		return timeline
+
+	def to_media(self, t):
+		t = np.asarray(t, dtype=np.float64)
+		k = np.searchsorted(self.starts, t, 'right') - 1
+		edit = np.clip(k, 0, len(self.starts) - 1)
+
+		media = self.mediastarts[edit] + (t - self.starts[edit]) * self.rates[edit]
+		valid = (k >= 0) & (t < self.ends[edit]) & ~self.empty[edit]
+		return np.where(valid, media, np.nan)
+
+	def to_presentation(self, m):
+		# first presentation of media time m
+		m = np.asarray(m, dtype=np.float64)
+		result = np.empty(m.shape)
+		result.fill(np.nan)
+
+		for k in reversed(xrange(len(self.starts))):
+			if self.empty[k] or self.rates[k] <= 0:
+				continue # dwells show one instant, no range
+
+			low = self.mediastarts[k]
+			high = low + (self.ends[k] - self.starts[k]) * self.rates[k]
+			with np.errstate(invalid='ignore'): # nan compares False
+				inside = (m >= low) & (m < high)
+			result = np.where(inside, self.starts[k] + (m - low) / self.rates[k], result)
+
+		return result
+
+	def sample_at(self, t):
+		# sample shown at presentation time t
+		media = self.to_media(t)
+		if len(self.order) == 0:
+			return np.zeros(media.shape, dtype=np.int64) - 1
+
+		i = np.searchsorted(self.ctsorted, media, 'right') - 1
+		with np.errstate(invalid='ignore'): # nan compares False
+			valid = (i >= 0) & (media < self.mediaend)
+		return np.where(valid, self.order[np.clip(i, 0, None)], -1)
+
+	def presentation_times(self, indexes=None):
+		# when samples (all, by default) are first shown
+		cts = self.samples.cts if (indexes is None) else self.samples.cts[np.asarray(indexes)]
+		return self.to_presentation(cts / float(self.samples.timescale))
+
+def timelines(buf):
+	# track_id -> Timeline
+	tracks = track_indexes(buf)
+	(start, size, type, headersize) = [atom for atom in iter_atoms(buf) if atom[2] == 'moov'][0]
+	mvhd = [
+		atom.content
+		for atom in parse_sequence(type, start+headersize, buf[start+headersize:start+size], [type], lazy=True)
+		if atom.type == 'mvhd'
+	][0]
+
+	return dict(
+		(track_id, Timeline.from_track(tracks[track_id], mvhd.timescale))
+		for track_id in tracks
+	)
+
+# ======================================================================
+# NAL unit types per sample (H.264, HEVC)
+
+avc_idr = 1 << 5
+avc_sei = 1 << 6
+hevc_irap = np.uint64(sum(1 << t for t in xrange(16, 24))) # BLA, IDR, CRA
+hevc_sei = np.uint64((1 << 39) | (1 << 40))
+
+def nal_types(buf, samples, lengthsize, hevc=False, probe=64, maxgap=2**12, maxread=2**20):
+	# per sample, a bitmask (1 << type) of its NAL unit types up to the first
+	# picture (VCL) one. only the first bytes of a sample are read (more if
+	# leading units are longer); reads of samples close in the file are merged
+	masks = np.zeros(len(samples), dtype=(np.uint64 if hevc else np.uint32))
+	if len(samples) == 0:
+		return masks
+
+	fmt = {1: ">B", 2: ">H", 4: ">I"}[lengthsize]
+	(typeshift, typemask, vclend) = (1, 0x3F, 32) if hevc else (0, 0x1F, 6)
+
+	order = np.argsort(samples.offset, kind='mergesort')
+	offsets = samples.offset[order].tolist()
+	ends = (samples.offset + samples.size)[order].tolist()
+	probeends = (samples.offset + np.minimum(samples.size, probe))[order].tolist()
+
+	# groups of samples read at once: (first, stop) into order
+	groups = []
+	(first, readstart, readend) = (0, offsets[0], probeends[0])
+	for i in xrange(1, len(offsets)):
+		if offsets[i] - readend > maxgap or probeends[i] - readstart > maxread:
+			groups.append((first, i, readstart, readend))
+			(first, readstart) = (i, offsets[i])
+		readend = max(readend, probeends[i])
+	groups.append((first, len(offsets), readstart, readend))
+
+	for (first, stop, readstart, readend) in groups:
+		data = buf[readstart:readend].str()
+
+		for i in xrange(first, stop):
+			(pos, end, mask) = (offsets[i], ends[i], 0)
+			(window, windowstart) = (data, readstart)
+
+			while pos + lengthsize < end:
+				if pos + lengthsize + 1 > windowstart + len(window): # past what was read
+					(window, windowstart) = (buf[pos:min(end, pos + probe)].str(), pos)
+
+				(length,) = struct.unpack_from(fmt, window, pos - windowstart)
+				naltype = (ord(window[pos - windowstart + lengthsize]) >> typeshift) & typemask
+				mask |= 1 << naltype
+				if naltype < vclend and (hevc or naltype > 0):
+					break
+
+				pos += lengthsize + length
+
+			masks[order[i]] = mask
+
+	return masks
+
+def classify_nal_units(buf, tracks):
+	# sets samples.nal of the H.264/HEVC tracks in tracks (from track_indexes),
+	# from their first sample description
+	for track in tracks.values():
+		description = select(track.trak, ['mdia', 'minf', 'stbl', 'stsd'])[0]
+		if 'avcC' in description:
+			track.samples.nal = nal_types(buf, track.samples, description.avcC.lengthsize)
+		elif 'hvcC' in description:
+			track.samples.nal = nal_types(buf, track.samples, description.hvcC.lengthsize, hevc=True)
+
+	return tracks
+
+def track_defaults(moov):
+	# per track_id: timescale and trex sample defaults, from moov's children
+	tracks = {}
+
+	for atom in moov:
+		if atom.type == 'trak':
+			track_id = select(atom.content, ['tkhd']).track_id
+			tracks[track_id] = Record(
+				track_id = track_id,
+				timescale = select(atom.content, ['mdia', 'mdhd']).scale,
+				description = 1,
+				duration = 0,
+				size = 0,
+				flags = 0
+			)
+
+		elif atom.type == 'mvex':
+			for trex in atom.content:
+				if trex.type == 'trex':
+					defaults = trex.content
+					for key in ('description', 'duration', 'size', 'flags'):
+						tracks[defaults.track_id][key] = defaults[key]
+
+	return tracks
+
+def fragment_indexes(moof, tracks, ends=None):
+	# SampleIndex per track_id for the samples of one moof atom.
+	# without tfdt, tracks continue from ends (updated), as in a sequential read
+	if ends is None:
+		ends = {}
+
+	result = {}
+	dataend = moof.start # for trafs that neither give a base nor use the moof
+
+	for (itraf, traf) in enumerate(atom for atom in moof.content if atom.type == 'traf'):
+		boxes = [atom.content for atom in traf.content if atom.type == 'tfhd']
+		assert len(boxes) == 1
+		tfhd = boxes[0]
+		track = tracks[tfhd.track_id]
+
+		def default(key):
+			return track[key] if (tfhd[key] is None) else tfhd[key]
+
+		if tfhd.base_offset is not None:
+			base = tfhd.base_offset
+		elif tfhd.base_is_moof or itraf == 0:
+			base = moof.start
+		else:
+			base = dataend
+
+		dts = ends.get(tfhd.track_id, 0)
+		pos = base
+		columns = []
+		lastdelta = None
+
+		for atom in traf.content:
+			if atom.type == 'tfdt':
+				dts = atom.content.time
+
+			elif atom.type == 'trun':
+				trun = atom.content
+				n = trun.count
+				samples = trun.samples
+				fields = samples.dtype.names if (samples is not None) else ()
+
+				def column(name, value):
+					if name in fields:
+						return samples[name].astype(np.int64)
+					res = np.empty(n, dtype=np.int64)
+					res.fill(value)
+					return res
+
+				durations = column('duration', default('duration'))
+				sizes = column('size', default('size'))
+				flags = column('flags', default('flags'))
+				ctos = column('cto', 0)
+				if trun.first_flags is not None and n > 0:
+					flags[0] = trun.first_flags
+
+				if trun.data_offset is not None:
+					pos = base + trun.data_offset
+
+				offsets = pos + np.cumsum(sizes) - sizes
+				times = dts + np.cumsum(durations) - durations
+				# sample_is_non_sync_sample
+				columns.append((offsets, sizes, times, times + ctos, (flags & 0x10000) == 0))
+
+				pos += int(sizes.sum())
+				dts += int(durations.sum())
+				if n > 0:
+					lastdelta = int(durations[-1])
+
+		dataend = pos
+		ends[tfhd.track_id] = dts
+
+		if columns:
+			columns = [np.concatenate(column) for column in zip(*columns)]
+			result[tfhd.track_id] = SampleIndex(*columns, timescale=track.timescale, lastdelta=lastdelta)
+
+	return result
+
+def iter_atoms(buf, start=0, clip=False):
+	# top level (start, size, type, headersize), reading only headers.
+	# asks streams no further than needed. clip: an atom cut short by the
+	# end of the file comes out with the size it has, and ends the walk
+	while buf.has(start):
+		if not buf.has(start+7):
+			raise AtomIncomplete(None, start, start+8, buf.known_len())
+
+		(size, type) = struct.unpack(">I4s", buf[start:start+8].str())
+		headersize = 8
+
+		if size == 1:
+			headersize = 16
+			if not buf.has(start+15):
+				raise AtomIncomplete(type, start, start+16, buf.known_len())
+			(size,) = struct.unpack(">Q", buf[start+8:start+16].str())
+		elif size == 0:
+			# runs to the end. a stream would have to be read (and held) all
+			# the way to find out where that is
+			assert buf.sized(), "%s atom at %d extends to the end of the stream, size unknown" % (type, start)
+			size = len(buf) - start
+
+		if size < headersize:
+			# would never advance. reported like a cut off atom: ends before its header does
+			raise AtomIncomplete(type, start, start+headersize, start+size)
+
+		if not buf.has(start+size-1):
+			# has() came back False: a stream has ended, its length is known
+			end = buf.known_len()
+			if clip and end >= start + headersize:
+				yield (start, end - start, type, headersize)
+				return
+			raise AtomIncomplete(type, start, start+size, end)
+
+		yield (start, size, type, headersize)
+		start += size
+
+def iter_fragments(buf):
+	# streaming mode: one Record(moof, sequence, tracks) per fragment, holding
+	# only that moof's atoms. tracks maps track_id -> SampleIndex
+	tracks = None
+	ends = {}
+
+	for (start, size, type, headersize) in iter_atoms(buf):
+		if type not in ('moov', 'moof'):
+			continue
+
+		# the moov only for its track defaults: lazily, past udta and the like
+		content = parse_sequence(type, start+headersize, buf[start+headersize:start+size], [type], lazy=(type == 'moov'))
+
+		if type == 'moov':
+			tracks = track_defaults(content)
+			continue
+
+		assert tracks is not None, "moof before moov"
+		moof = Atom(start, size, type, content, buf=buf[start:start+size])
+		sequence = [atom.content.sequence for atom in content if atom.type == 'mfhd']
+
+		yield Record(
+			moof = moof,
+			sequence = sequence[0] if sequence else None,
+			tracks = fragment_indexes(moof, tracks, ends)
+		)
+
+def fragment_at(buf, t, track_id=None):
+	# offset of the moof holding time t (seconds) of a track, by mfra or sidx,
+	# without walking the fragments. None if the file has neither
+	tracks = None
+	sidxs = []
+
+	for (start, size, type, headersize) in iter_atoms(buf):
+		if type in ('moof', 'mdat'):
+			break
+
+		if type in ('moov', 'sidx'):
+			content = parse_sequence(None, start, buf[start:start+size], lazy=True)[0].content
+			if type == 'moov':
+				tracks = track_defaults(content)
+			else:
+				sidxs.append(content)
+
+	assert tracks, "no moov"
+	if track_id is None:
+		track_id = min(tracks)
+
+	# mfra ends the file, and its size is in the trailing mfro
+	end = len(buf)
+	if end >= 16 and buf[end-16:end-8].str()[4:] == 'mfro':
+		mfrasize = struct.unpack(">I", buf[end-4:end].str())[0]
+		(mfra,) = parse_sequence(None, end-mfrasize, buf[end-mfrasize:end])
+		assert mfra.type == 'mfra'
+
+		for atom in mfra.content:
+			if atom.type == 'tfra' and atom.content.track_id == track_id:
+				tfra = atom.content
+				i = np.searchsorted(tfra.times, t * tracks[track_id].timescale, 'right') - 1
+				return int(tfra.offsets[max(i, 0)])
+
+	for sidx in sidxs:
+		if sidx.reference_id == track_id:
+			i = np.searchsorted(sidx.times, t * sidx.timescale, 'right') - 1
+			return int(sidx.offsets[max(i, 0)])
+
+	return None
+
+def handler_type(trak):
+	# 'vide', 'soun', ... from the track's media hdlr
+	hdlr = select(trak, ['mdia', 'hdlr'])
+	return hdlr[8:12].str()
+
+def track_indexes(buf, partial=False):
+	# track_id -> Record(track_id, handler, timescale, trak, samples), with
+	# samples from the moov tables, followed by any fragments'.
+	# partial: the file may be cut short, index what is there
+	atoms = list(iter_atoms(buf, clip=partial))
+	moovs = [atom for atom in atoms if atom[2] == 'moov']
+	assert moovs, "no moov"
+
+	(start, size, type, headersize) = moovs[0]
+	moov = parse_sequence(type, start+headersize, buf[start+headersize:start+size], [type], lazy=True)
+
+	tracks = {}
+	for atom in moov:
+		if atom.type != 'trak':
+			continue
+
+		trak = atom.content
+		track_id = select(trak, ['tkhd']).track_id
+		tracks[track_id] = Record(
+			track_id = track_id,
+			handler = handler_type(trak),
+			timescale = select(trak, ['mdia', 'mdhd']).scale,
+			trak = trak,
+			samples = SampleIndex.from_trak(trak)
+		)
+
+	if any(atom[2] == 'moof' for atom in atoms):
+		parts = dict((track_id, [tracks[track_id].samples]) for track_id in tracks)
+		try:
+			for fragment in iter_fragments(buf):
+				for track_id in fragment.tracks:
+					parts[track_id].append(fragment.tracks[track_id])
+		except AtomIncomplete:
+			if not partial:
+				raise
+
+		for track_id in tracks:
+			tracks[track_id].samples = SampleIndex.concatenate(parts[track_id])
+
+	return tracks
+
+def verify_samples(buf):
+	# do all samples lie inside mdat payloads, without overlapping?
+	# and how much media time is there, per track and for the file (from the
+	# first video track, else the first track)
+	atoms = list(iter_atoms(buf, clip=True))
+	tracks = track_indexes(buf, partial=True)
+
+	mdats = [(start+headersize, start+size) for (start, size, type, headersize) in atoms if type == 'mdat']
+	mdatstarts = np.array([start for (start, end) in mdats], dtype=np.int64)
+	mdatends = np.array([end for (start, end) in mdats], dtype=np.int64)
+
+	def inside(offsets, sizes):
+		if len(mdats) == 0:
+			return np.zeros(len(offsets), dtype=bool)
+
+		i = np.searchsorted(mdatstarts, offsets, 'right') - 1
+		found = (i >= 0)
+		i = np.maximum(i, 0)
+		return found & (offsets >= mdatstarts[i]) & (offsets + sizes <= mdatends[i])
+
+	# overlaps, over all tracks' samples in file order
+	offsets = np.concatenate([tracks[track_id].samples.offset for track_id in sorted(tracks)] or [np.zeros(0, dtype=np.int64)])
+	sizes = np.concatenate([tracks[track_id].samples.size for track_id in sorted(tracks)] or [np.zeros(0, dtype=np.int64)])
+	order = np.argsort(offsets, kind='mergesort')
+	# against the furthest end before, not just the last: a big sample can
+	# cover several after it
+	reach = np.maximum.accumulate((offsets + sizes)[order])
+	overlapping = int(((reach[:-1] > offsets[order][1:]) & (sizes[order][1:] > 0)).sum())
+
+	results = []
+	for track_id in sorted(tracks):
+		track = tracks[track_id]
+		samples = track.samples
+		good = inside(samples.offset, samples.size)
+
+		durations = np.diff(np.append(samples.dts, samples.duration)) if len(samples) else np.zeros(0, dtype=np.int64)
+		bad = np.flatnonzero(~good)
+		playable = samples.dts[bad[0]] - samples.dts[0] if len(bad) else durations.sum()
+
+		results.append(Record(
+			track_id = track_id,
+			handler = track.handler,
+			samples = len(samples),
+			outside = len(bad),
+			total_ms = int(durations.sum() * 1000 // samples.timescale),
+			recoverable_ms = int(durations[good].sum() * 1000 // samples.timescale),
+			playable_ms = int(playable * 1000 // samples.timescale), # up to the first bad sample
+		))
+
+	reference = ([result for result in results if result.handler == 'vide'] or results or [None])[0]
+
+	return Record(
+		samples = sum(result.samples for result in results),
+		outside = sum(result.outside for result in results),
+		overlapping = overlapping,
+		total_ms = reference.total_ms if reference else 0,
+		recoverable_ms = reference.recoverable_ms if reference else 0,
+		tracks = results
+	)
+
+# ======================================================================
+# faststart: moov in front of mdat, without remuxing
+
+rewritten = ('moov', 'trak', 'edts', 'mdia', 'minf', 'stbl')
+
+def rewrite_atom(buf, start, size, headersize, type, patch, path=[]):
+	# bytes of the atom, rewritten by patch(path, start, content) per atom:
+	# a string replaces the content, (type, string) also the type, False
+	# drops the atom, None keeps it (containers get rewritten child by child)
+	path = path + [type]
+	content = buf[start+headersize:start+size]
+	body = patch(path, start, content)
+
+	if body is False:
+		return ''
+
+	elif isinstance(body, tuple):
+		(type, body) = body
+
+	elif body is None:
+		if type not in rewritten:
+			return buf[start:start+size].str()
+
+		body = ''.join(
+			rewrite_atom(buf, start+headersize+childstart, childsize, childheadersize, childtype, patch, path)
+			for (childstart, childsize, childtype, childheadersize) in iter_atoms(content)
+		)
+
+	if 8 + len(body) < 2**32:
+		return struct.pack('>I4s', 8 + len(body), type) + body
+	else:
+		return struct.pack('>I4sQ', 1, type, 16 + len(body)) + body
+
+def chunk_offsets(offsets, version=0, wide=False):
+	# (type, content) of a stco atom for these offsets, co64 if needed or wide
+	wide = wide or (len(offsets) > 0 and offsets.max() >= 2**32)
+	body = struct.pack('>B3xI', version, len(offsets))
+	body += np.asarray(offsets).astype('>u8' if wide else '>u4').tostring()
+	return ('co64' if wide else 'stco', body)
+
+def _shifted_offsets(shift, upgraded):
+	# patch for rewrite_atom: all chunk offsets passed through shift().
+	# stco tables that overflow become co64 (and stay so, in upgraded)
+	def patch(path, start, content):
+		type = path[-1]
+		if type not in ('stco', 'co64'):
+			return None
+
+		table = handlers[type](type, None, content[0:], path)
+		(type, body) = chunk_offsets(shift(table.offsets.astype(np.int64)), table.version,
+			wide=(type == 'co64' or start in upgraded))
+		if type == 'co64':
+			upgraded.add(start)
+
+		return (type, body)
+
+	return patch
+
+def faststart(fname, outfname=None):
+	# moves moov in front of mdat. into outfname if given, else in place:
+	# into a free atom before mdat if one can take it (nothing else moves,
+	# journaled), otherwise through a copy that replaces the file.
+	# returns False if the index already came first
+	buf = FileBuffer(fname)
+	try:
+		return _faststart(fname, outfname, buf)
+	finally:
+		buf.close()
+
+def _faststart(fname, outfname, buf):
+	atoms = list(iter_atoms(buf))
+	types = [type for (start, size, type, headersize) in atoms]
+	moovs = [atom for atom in atoms if atom[2] == 'moov']
+	mdats = [atom for atom in atoms if atom[2] == 'mdat']
+	assert len(moovs) == 1, "need exactly one moov"
+
+	moov = moovs[0]
+	(moovstart, moovsize, type, moovheadersize) = moov
+
+	if (not mdats) or moovstart < mdats[0][0]:
+		if outfname is not None:
+			with open(outfname, 'wb') as outfp:
+				copy_range(buf.source.fp, 0, len(buf), outfp, 0)
+		return False
+
+	# only stco/co64 get rewritten. tfhd base offsets and tfra entries are absolute too
+	assert 'moof' not in types and 'mfra' not in types, "fragmented files are not supported"
+
+	if outfname is None:
+		# a free atom before mdat that takes the moov whole, or leaves room for a free header
+		for (start, size, type, headersize) in atoms:
+			if start >= mdats[0][0]:
+				break
+
+			if type in ('free', 'skip') and (size == moovsize or size >= moovsize + 8):
+				moovdata = buf[moovstart:moovstart+moovsize].str()
+				if size > moovsize:
+					moovdata += struct.pack('>I4s', size - moovsize, 'free')
+
+				with FileBuffer(fname, 'r+b', journal=True) as filebuf:
+					filebuf.source.write(start, moovdata)
+					filebuf.source.write(moovstart+4, 'free')
+					filebuf.commit()
+
+				# the old moov ended the file: drop it rather than keep it as free space
+				if moovstart + moovsize == len(buf):
+					with open(fname, 'r+b') as fh:
+						fh.truncate(moovstart)
+				return True
+
+		tmpname = fname + '.faststart'
+		faststart(fname, tmpname)
+		os.rename(tmpname, fname)
+		return True
+
+	# new order: moov right after ftyp. chunk offsets follow their atom
+	rest = [atom for atom in atoms if atom is not moov]
+	at = 1 if (rest and rest[0][2] == 'ftyp') else 0
+
+	oldstarts = np.array([start for (start, size, type, headersize) in rest], dtype=np.int64)
+	sizes = np.array([size for (start, size, type, headersize) in rest], dtype=np.int64)
+
+	upgraded = set()
+	newmoovsize = moovsize
+	while True:
+		newsizes = np.insert(sizes, at, newmoovsize)
+		newstarts = np.cumsum(newsizes) - newsizes
+		newmoovstart = newstarts[at]
+		newstarts = np.delete(newstarts, at)
+
+		def shift(offsets):
+			i = np.searchsorted(oldstarts, offsets, 'right') - 1
+			return offsets - oldstarts[i] + newstarts[i]
+
+		moovdata = rewrite_atom(buf, moovstart, moovsize, moovheadersize, 'moov', _shifted_offsets(shift, upgraded))
+		if len(moovdata) == newmoovsize:
+			break
+		newmoovsize = len(moovdata) # co64 upgrades grow it, and move everything after
+
+	with open(outfname, 'wb') as outfp:
+		outfp.seek(newmoovstart)
+		outfp.write(moovdata)
+		outfp.flush()
+
+		for ((start, size, type, headersize), newstart) in zip(rest, newstarts):
+			copy_range(buf.source.fp, start, size, outfp, newstart)
+
+	return True
+
+# ======================================================================
+# index cache: parsed tree and sample tables in a sidecar, valid while the
+# file keeps its inode, size and mtime. arrays are mapped, not read back.
+# the tree is tagged JSON, so a cache file can't run code; and only caches
+# that nobody else could have written are used
+
+cachemagic = 'MP4IDX03'
+cachehead = struct.Struct('>QQdQ') # inode, size, mtime, length of the JSON tree
+cachealign = 4096
+cacheclasses = dict((cls.__name__, cls) for cls in (dict, Record)) # mappings that may come back
+
+def cache_name(fname, cachedir=None):
+	# next to the file, or in a shared cachedir by device and inode
+	if cachedir is None:
+		return fname + '.mp4idx'
+
+	st = os.stat(fname)
+	return os.path.join(cachedir, '%x-%x.mp4idx' % (st.st_dev, st.st_ino))
+
+def _cache_key(fname):
+	st = os.stat(fname)
+	return (st.st_ino, st.st_size, st.st_mtime)
+
+def _cache_trusted(fh):
+	# ours, and not writable by group or others
+	st = os.fstat(fh.fileno())
+	return st.st_uid == os.getuid() and not (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+def save_index(fname, atoms, indexes, cachename=None):
+	# everything becomes [tag, ...] lists, arrays go after the tree, aligned
+	if cachename is None:
+		cachename = cache_name(fname)
+
+	arrays = []
+	end = [0]
+
+	def store(x):
+		if isinstance(x, np.generic): # some are ints and floats too
+			return ['scalar', store(x.dtype), x.item()]
+		elif x is None or isinstance(x, (bool, int, long, float)):
+			return x
+		elif isinstance(x, str):
+			return ['str', x.decode('latin-1')]
+		elif isinstance(x, unicode):
+			return ['unicode', x]
+		elif isinstance(x, Atom):
+			return ['atom', x.start, x.length, store(x.type), store(x.content)]
+		elif isinstance(x, SampleIndex):
+			return ['samples', store(x.timescale), store(x.lastdelta), [store(x.offset), store(x.size), store(x.dts), store(x.cts), store(x.keyframe)]]
+		elif isinstance(x, BufferCursor):
+			return store(x.buf)
+		elif isinstance(x, Buffer):
+			return ['raw', x.start, len(x)]
+		elif isinstance(x, np.ndarray):
+			arrays.append((end[0], x))
+			offset = end[0]
+			end[0] += (x.nbytes + 63) // 64 * 64
+			return ['array', offset, store(x.dtype), list(x.shape)]
+		elif isinstance(x, np.dtype):
+			return ['dtype', store(x.str if (x.fields is None) else x.descr)]
+		elif isinstance(x, dict):
+			assert cacheclasses.get(x.__class__.__name__) is x.__class__, "can't cache a %s" % x.__class__.__name__
+			return ['dict', x.__class__.__name__, [[store(key), store(x[key])] for key in x]]
+		elif isinstance(x, list):
+			return ['list', [store(item) for item in x]]
+		elif isinstance(x, tuple):
+			return ['tuple', [store(item) for item in x]]
+		else:
+			assert False, "can't cache a %s" % type(x).__name__
+
+	tree = json.dumps([store(atoms), store(indexes)], separators=(',', ':'))
+	head = cachemagic + cachehead.pack(*(_cache_key(fname) + (len(tree),)))
+	datastart = -(-(len(head) + len(tree)) // cachealign) * cachealign
+
+	# a fresh name: in a shared cachedir, a fixed one could be someone's symlink
+	(fd, tmpname) = tempfile.mkstemp('.tmp', os.path.basename(cachename) + '.', os.path.dirname(os.path.abspath(cachename)))
+	with os.fdopen(fd, 'wb') as fh:
+		os.fchmod(fh.fileno(), 0644)
+		fh.write(head)
+		fh.write(tree)
+		for (offset, array) in arrays:
+			fh.seek(datastart + offset)
+			fh.write(np.ascontiguousarray(array).tostring())
+	os.rename(tmpname, cachename)
+
+def load_index(fname, cachename=None):
+	# (atoms, indexes) from the sidecar, None if there is none, it's stale,
+	# or someone else could have written it
+	if cachename is None:
+		cachename = cache_name(fname)
+
+	try:
+		fh = open(cachename, 'rb')
+	except IOError:
+		return None
+
+	with fh:
+		if not _cache_trusted(fh):
+			return None
+
+		head = fh.read(len(cachemagic) + cachehead.size)
+		if len(head) < len(cachemagic) + cachehead.size or not head.startswith(cachemagic):
+			return None
+
+		(inode, size, mtime, treelen) = cachehead.unpack(head[len(cachemagic):])
+		if (inode, size, mtime) != _cache_key(fname):
+			return None
+
+		(atoms, indexes) = json.loads(fh.read(treelen))
+		datastart = -(-(len(head) + treelen) // cachealign) * cachealign
+		mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+	fb = FileBuffer(fname)
+
+	def load(x):
+		if not isinstance(x, list):
+			return x
+
+		tag = x[0]
+		if tag == 'str':
+			return x[1].encode('latin-1')
+		elif tag == 'unicode':
+			return x[1]
+		elif tag == 'atom':
+			(tag, start, length, type, content) = x
+			return Atom(start, length, load(type), load(content), buf=fb[start:start+length])
+		elif tag == 'samples':
+			(tag, timescale, lastdelta, columns) = x
+			return SampleIndex(*map(load, columns), timescale=load(timescale), lastdelta=load(lastdelta))
+		elif tag == 'raw':
+			(tag, start, length) = x
+			return fb[start:start+length]
+		elif tag == 'array':
+			(tag, offset, dtype, shape) = x
+			(dtype, shape) = (load(dtype), tuple(shape))
+			count = int(np.prod(shape))
+			if count == 0:
+				return np.empty(shape, dtype=dtype)
+			return np.frombuffer(mapped, dtype=dtype, count=count, offset=datastart+offset).reshape(shape)
+		elif tag == 'dtype':
+			return np.dtype(load(x[1]))
+		elif tag == 'scalar':
+			return load(x[1]).type(x[2])
+		elif tag == 'dict':
+			(tag, classname, items) = x
+			res = cacheclasses[classname]()
+			for (key, value) in items:
+				res[load(key)] = load(value)
+			return res
+		elif tag == 'list':
+			return [load(item) for item in x[1]]
+		elif tag == 'tuple':
+			return tuple(load(item) for item in x[1])
+
+		assert False, "unknown tag %r in %s" % (tag, cachename)
+
+	return (load(atoms), load(indexes))
+
+def cached_parse(fname, cachedir=None):
+	# (atoms, sample indexes): from the cache if current, else parsed and cached
+	cachename = cache_name(fname, cachedir)
+
+	result = load_index(fname, cachename)
+	if result is not None:
+		return result
+
+	atoms = parse(FileBuffer(fname))
+	indexes = sample_indexes(atoms)
+
+	try:
+		save_index(fname, atoms, indexes, cachename)
+	except EnvironmentError, e:
+		if e.errno not in (errno.EACCES, errno.EPERM): # unwritable cache (or someone else's) is no cache
+			raise
+
+	return (atoms, indexes)
+
 # ======================================================================
 
 verbose = False
@@ -885,7 +2304,9 @@ if __name__ == '__main__':
 	statuses = {
 		0: "GOOD",
 		1: "INCOMPLETE",
-		3: "INDEX NOT AT BEGINNING"
+		2: "SAMPLES MISSING",
+		3: "INDEX NOT AT BEGINNING",
+		4: "SAMPLES NOT VERIFIABLE",
 	}
 
 	fnames = []
@@ -893,7 +2314,17 @@ if __name__ == '__main__':
 	#fnames.append('mp4 parsing\\8Juv1MVa-483.mp4')
 	#fnames.append('mp4 parsing\\8Juv1MVa-483 - Copy.mp4')
 
+	flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+	iostats = ('--io-stats' in flags)
+	fragments = ('--fragments' in flags)
+	deep = ('--deep' in flags) # full parse, else top-level headers only
+	dofaststart = ('--faststart' in flags) # move the index in front, in place
+	usecache = ('--cache' in flags) # deep parse through the sidecar index cache
+	doverify = ('--verify' in flags) # check sample ranges against mdat
+	donal = ('--nal' in flags) # NAL unit types of H.264/HEVC samples
+
 	for globbable in sys.argv[1:]:
+		if globbable in flags: continue
 		fnames += glob.glob(globbable)
 
 	for fname in fnames:
@@ -902,19 +2333,33 @@ if __name__ == '__main__':
 		print fname
 		#print
 
-		fb = FileBuffer(fname)
+		stats = IOStats() if iostats else None
+		fb = FileBuffer(fname, stats=stats)
 
 		status = 0
 		atoms = None
 		exception = None
 		try:
-			atoms = parse(fb)
+			if deep and usecache:
+				(atoms, indexes) = cached_parse(fname)
+			elif deep:
+				atoms = parse(fb)
+			else:
+				atoms = []
+				for (start, size, type, headersize) in iter_atoms(fb):
+					print "%s  [@%d + %d]" % (type, start, size)
+					atoms.append(Atom(start, size, type))
 		except AtomIncomplete, exception:
 			print exception
 			status = 1
 
+		if dofaststart and status == 0 and faststart(fname):
+			print "moved index to beginning of file"
+			fb = FileBuffer(fname, stats=stats)
+			atoms = parse(fb) if deep else [Atom(start, size, type) for (start, size, type, headersize) in iter_atoms(fb)]
+
 		# check position of index
-		if atoms:
+		if atoms and status == 0:
 			for atom in atoms:
 				if atom.start > 1e6:
 					# no index found below 1 MB
@@ -922,14 +2367,64 @@ if __name__ == '__main__':
 					print "index not at beginning of file!"
 					break
 
-				if atom.type == 'moov':
-					# index found, done here
+				if atom.type in ('moov', 'moof'):
+					# index found (or fragmented, indexed as it goes), done here
 					break
 
+		if doverify:
+			verbose = False
+			try:
+				check = verify_samples(fb)
+			except (AssertionError, AtomIncomplete), e:
+				print "could not verify samples: %s: %s" % (e.__class__.__name__, e)
+				if status == 0:
+					status = 4
+			else:
+				for track in check.tracks:
+					print "track %d (%s): %d of %d samples outside mdat, %d of %d ms recoverable, playable to %d ms" % (
+						track.track_id, track.handler, track.outside, track.samples,
+						track.recoverable_ms, track.total_ms, track.playable_ms)
+				if check.overlapping:
+					print "%d samples overlap" % check.overlapping
+				print "recoverable: %d of %d ms" % (check.recoverable_ms, check.total_ms)
+
+				if (check.outside or check.overlapping) and status == 0:
+					status = 2
+			verbose = True
+
+		if donal and status != 1:
+			verbose = False
+			tracks = classify_nal_units(fb, track_indexes(fb))
+			for track_id in sorted(tracks):
+				(track, samples) = (tracks[track_id], tracks[track_id].samples)
+				if samples.nal is None:
+					continue
+
+				hevc = (samples.nal.dtype == np.uint64)
+				random = (samples.nal & (hevc_irap if hevc else avc_idr)) != 0
+				sei = (samples.nal & (hevc_sei if hevc else avc_sei)) != 0
+				print "track %d (%s): %d samples, %d keyframes, %d %s, %d keyframes without, %d with SEI" % (
+					track.track_id, 'HEVC' if hevc else 'H.264', len(samples), samples.keyframe.sum(),
+					random.sum(), 'IRAP' if hevc else 'IDR', (samples.keyframe & ~random).sum(), sei.sum())
+			verbose = True
+
 		if status == 0:
 			print "file looks okay"
 			#print
 
+		if fragments and status != 1:
+			verbose = False
+			for fragment in iter_fragments(fb):
+				print "moof #%s @%d:" % (fragment.sequence, fragment.moof.start),
+				print ", ".join(
+					"track %d %r" % (track_id, fragment.tracks[track_id])
+					for track_id in sorted(fragment.tracks)
+				)
+			verbose = True
+
+		if stats:
+			print stats.report()
+
 		try:	
 			# clean up previous statuses
 			for x in glob.glob(os.path.abspath(fname) + sig + '*'):
@@ -945,9 +2440,7 @@ if __name__ == '__main__':
 		try:
 			with open(x, 'w') as fh:
 				if atoms:
-					for i, atom in enumerate(atoms):
-						fh.write(atom.__repr__(index=i))
-						fh.write('\n')
+					write_report(fh, atoms)
 				if exception:
 					fh.write('%s: %s\n' % (exception.__class__.__name__, exception))
 			os.chmod(x, 0664)
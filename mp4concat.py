@@ -0,0 +1,176 @@
+#!/usr/bin/env python2.7
+from __future__ import division
+import os
+import sys
+import glob
+import struct
+import numpy as np
+
+import mp4check
+from mp4check import Record, SampleIndex, select, iter_atoms, rewrite_atom
+from mp4cut import sample_descriptions, plan_track, cut_patch, edit_list
+from filetools import FileBuffer, copy_range
+
+# lossless concatenation of mp4 files with the same tracks and sample
+# descriptions (sessions of one recording). the first file's moov gets the
+# merged sample tables; the output is faststart, with one mdat holding each
+# input's media data, copied whole (copy_file_range where possible).
+# every input starts where the longest track of the one before ended.
+# the edit lists (start delay, media time) must match; the output gets the
+# first input's, over the summed duration.
+#
+# mp4concat.py outfile infiles...
+#   infiles in order; globs expand sorted
+
+def load(fname):
+	buf = FileBuffer(fname)
+	atoms = list(iter_atoms(buf))
+	types = [type for (start, size, type, headersize) in atoms]
+	assert 'moof' not in types, "%s: fragmented files are not supported" % fname
+	assert types.count('moov') == 1, "%s: %d moov atoms" % (fname, types.count('moov'))
+
+	tree = mp4check.parse(buf, lazy=True)
+	tracks = mp4check.track_indexes(buf)
+	trackorder = [
+		select(atom.content, ['tkhd']).track_id
+		for atom in select(tree, ['moov'])
+		if atom.type == 'trak'
+	]
+
+	# the span of the file holding all samples, copied as is
+	indexes = [tracks[track_id].samples for track_id in trackorder if len(tracks[track_id].samples)]
+	assert indexes, "%s: no samples" % fname
+	spanstart = min(samples.offset.min() for samples in indexes)
+	spanend = max((samples.offset + samples.size).max() for samples in indexes)
+
+	return Record(
+		fname = fname,
+		buf = buf,
+		atoms = atoms,
+		tree = tree,
+		tracks = tracks,
+		trackorder = trackorder,
+		movietimescale = select(tree, ['moov', 'mvhd']).timescale,
+		spanstart = int(spanstart),
+		spansize = int(spanend - spanstart),
+		duration = max(samples.duration / samples.timescale for samples in indexes),
+	)
+
+def sample_description_bytes(input, track_id):
+	(atom,) = [atom for atom in select(input.tracks[track_id].trak, ['mdia', 'minf', 'stbl']) if atom.type == 'stsd']
+	return input.buf[atom.start:atom.start+atom.length].str()
+
+def check_compatible(inputs):
+	first = inputs[0]
+
+	for input in inputs[1:]:
+		assert len(input.trackorder) == len(first.trackorder), "%s has %d tracks, %s %d" % (
+			input.fname, len(input.trackorder), first.fname, len(first.trackorder))
+
+		for (a, b) in zip(first.trackorder, input.trackorder):
+			(tracka, trackb) = (first.tracks[a], input.tracks[b])
+			assert tracka.handler == trackb.handler, "%s: track %d is %s, not %s" % (input.fname, b, trackb.handler, tracka.handler)
+			assert tracka.timescale == trackb.timescale, "%s: track %d timescale %d, not %d" % (input.fname, b, trackb.timescale, tracka.timescale)
+			assert sample_description_bytes(first, a) == sample_description_bytes(input, b), \
+				"%s: track %d sample descriptions differ from %s's" % (input.fname, b, first.fname)
+			assert leading_edits(tracka.trak) == leading_edits(trackb.trak), \
+				"%s: track %d edit list %r, %s has %r" % (input.fname, b, edit_list(trackb.trak), first.fname, edit_list(tracka.trak))
+
+def leading_edits(trak):
+	# (empty edits' duration, first media time), what the merged edit list keeps
+	edits = edit_list(trak)
+	empty = 0
+	for edit in edits:
+		if edit['start'] != -1:
+			break
+		empty += edit['duration']
+	mediastarts = [edit['start'] for edit in edits if edit['start'] != -1]
+	return (empty, mediastarts[0] if mediastarts else None)
+
+def merge_track(inputs, position, dataoffsets, starts):
+	# samples of the track at position in all inputs, offsets relative to the
+	# output's media data, times continuing at each input's start.
+	# and the sample description of every sample
+	(parts, descriptions) = ([], [])
+
+	for (input, dataoffset, start) in zip(inputs, dataoffsets, starts):
+		track = input.tracks[input.trackorder[position]]
+		samples = track.samples
+		shift = int(round(start * samples.timescale))
+
+		parts.append(SampleIndex(
+			samples.offset - input.spanstart + dataoffset,
+			samples.size,
+			samples.dts + shift,
+			samples.cts + shift,
+			samples.keyframe,
+			samples.timescale,
+			samples.lastdelta))
+		descriptions.append(sample_descriptions(track.trak, len(samples)))
+
+	return (SampleIndex.concatenate(parts), np.concatenate(descriptions))
+
+def concat_patch(plans, trackorder, shift):
+	# the cut's patch over all samples; sdtp is per sample and not merged
+	cutpatch = cut_patch(plans, trackorder, shift)
+
+	def patch(path, start, content):
+		if path[-1] == 'sdtp':
+			return False
+		return cutpatch(path, start, content)
+
+	return patch
+
+def concat(fnames, outfname):
+	inputs = [load(fname) for fname in fnames]
+	check_compatible(inputs)
+
+	first = inputs[0]
+	dataoffsets = np.cumsum([0] + [input.spansize for input in inputs]).tolist()
+	starts = np.cumsum([0] + [input.duration for input in inputs]).tolist()
+
+	plans = {}
+	for (position, track_id) in enumerate(first.trackorder):
+		(samples, descriptions) = merge_track(inputs, position, dataoffsets, starts)
+		track = Record(track_id=track_id, trak=first.tracks[track_id].trak, samples=samples)
+		plans[track_id] = plan_track(track, 0, len(samples), first.movietimescale, descriptions)
+
+	datasize = dataoffsets[-1]
+	ftyp = ''.join(first.buf[start:start+size].str() for (start, size, type, headersize) in first.atoms if type == 'ftyp')
+	mdathead = struct.pack('>I4s', datasize + 8, 'mdat') if (datasize + 8 < 2**32) else struct.pack('>I4sQ', 1, 'mdat', datasize + 16)
+	(moovstart, moovsize, type, moovheadersize) = [atom for atom in first.atoms if atom[2] == 'moov'][0]
+
+	# offsets depend on the moov's size, which can grow with co64
+	moovdata = ''
+	while True:
+		datastart = len(ftyp) + len(moovdata) + len(mdathead)
+		shift = lambda offsets: offsets + datastart
+		newmoov = rewrite_atom(first.buf, moovstart, moovsize, moovheadersize, 'moov', concat_patch(plans, first.trackorder, shift))
+
+		(moovdata, done) = (newmoov, len(newmoov) == len(moovdata))
+		if done:
+			break
+
+	with open(outfname, 'wb') as outfp:
+		outfp.write(ftyp + moovdata + mdathead)
+		outfp.flush()
+		for (input, dataoffset) in zip(inputs, dataoffsets):
+			copy_range(input.buf.source.fp, input.spanstart, input.spansize, outfp, datastart + dataoffset)
+
+	return starts
+
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	assert len(args) >= 2, "mp4concat.py outfile infiles..."
+
+	outfname = args[0]
+	assert not os.path.exists(outfname)
+
+	fnames = []
+	for globbable in args[1:]:
+		fnames += sorted(glob.glob(globbable))
+
+	starts = concat(fnames, outfname)
+	for (fname, start) in zip(fnames, starts):
+		print "%10.3fs  %s" % (start, fname)
+	print "%10.3fs  total" % starts[-1]
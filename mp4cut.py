@@ -0,0 +1,315 @@
+#!/usr/bin/env python2.7
+from __future__ import division
+import os
+import sys
+import struct
+import numpy as np
+
+import mp4check
+from mp4check import select, iter_atoms, rewrite_atom, chunk_offsets
+from filetools import FileBuffer, copy_range
+
+# lossless cut of an mp4 to a time range, snapped to keyframes.
+# only the sample tables and durations are rewritten, and only the mdat
+# bytes of the kept samples are copied (copy_file_range where possible),
+# as the ranges they lie in.
+#
+# mp4cut.py infile outfile start [end]
+#   times in seconds or [[h:]m:]s
+
+def parse_time(s):
+	seconds = 0
+	for part in s.split(':'):
+		seconds = seconds * 60 + float(part)
+	return seconds
+
+def runs(*columns):
+	# run-length encoding over rows of the columns: (starts, lengths)
+	n = len(columns[0])
+	if n == 0:
+		return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+	change = np.zeros(n, dtype=bool)
+	change[0] = True
+	for column in columns:
+		change[1:] |= (column[1:] != column[:-1])
+
+	starts = np.flatnonzero(change)
+	return (starts, np.diff(np.append(starts, n)))
+
+def fullbox(version, *parts):
+	return struct.pack('>B3x', version) + ''.join(parts)
+
+def table(dtype, *columns):
+	# atom body for a table: count, then the rows
+	rows = np.empty(len(columns[0]), dtype=[('f%d' % i, dtype) for i in xrange(len(columns))])
+	for (i, column) in enumerate(columns):
+		rows['f%d' % i] = column
+	return struct.pack('>I', len(rows)) + rows.tostring()
+
+# ----------------------------------------------------------------------
+
+def sample_descriptions(trak, nsamples):
+	# sample description index of every sample, from stsc
+	stbl = dict((atom.type, atom.content) for atom in select(trak, ['mdia', 'minf', 'stbl']))
+	co = stbl['stco'] if ('stco' in stbl) else stbl['co64']
+	entries = stbl['stsc'].entries
+
+	perchunk = mp4check.stsc_expand(entries, len(co.offsets))
+	firsts = entries['first'].astype(np.int64) - 1
+	descriptions = np.repeat(entries['description'].astype(np.int64), np.diff(np.append(firsts, len(co.offsets))))
+
+	return np.repeat(descriptions, perchunk)[:nsamples]
+
+def edit_list(trak):
+	# the track's elst entries, [] without
+	for atom in trak:
+		if atom.type == 'edts':
+			for child in atom.content:
+				if child.type == 'elst':
+					return child.content
+	return []
+
+def plan_track(track, begin, end, movietimescale, descriptions=None):
+	# sample range [begin, end) of a track, and its new tables.
+	# descriptions: per sample, if not those of track.trak
+	samples = track.samples
+	n = len(samples)
+
+	dts = samples.dts[begin:end]
+	if end < n:
+		deltas = np.diff(samples.dts[begin:end+1])
+	elif end > begin:
+		deltas = np.append(np.diff(dts), samples.duration - samples.dts[-1])
+	else:
+		deltas = np.zeros(0, dtype=np.int64)
+
+	duration = int(deltas.sum())
+
+	if descriptions is None:
+		descriptions = sample_descriptions(track.trak, n)
+	descriptions = descriptions[begin:end]
+	offsets = samples.offset[begin:end]
+	sizes = samples.size[begin:end]
+
+	# chunks: runs of samples back to back in the file, with one description
+	if end > begin:
+		contiguous = np.append([False], offsets[1:] == offsets[:-1] + sizes[:-1])
+		(chunkstarts, chunklengths) = runs(np.cumsum(~contiguous), descriptions)
+	else:
+		(chunkstarts, chunklengths) = runs(offsets)
+
+	# leading empty edits (a delayed start) stay, and the first real edit's media time
+	edits = edit_list(track.trak)
+	empty = 0
+	for edit in edits:
+		if edit['start'] != -1:
+			break
+		empty += edit['duration']
+	mediastarts = [edit['start'] for edit in edits if edit['start'] != -1]
+
+	return mp4check.Record(
+		track_id = track.track_id,
+		begin = begin,
+		end = end,
+		deltas = deltas,
+		ctos = samples.cts[begin:end] - dts,
+		keyframes = np.flatnonzero(samples.keyframe[begin:end]) + 1,
+		sizes = sizes,
+		chunkstarts = chunkstarts,
+		chunklengths = chunklengths,
+		chunkoffsets = offsets[chunkstarts],
+		chunkdescriptions = descriptions[chunkstarts],
+		duration = duration,
+		movieduration = int(round(duration * movietimescale / samples.timescale)),
+		mediatime = int((samples.cts[begin:end] - dts[0]).min()) if end > begin else 0,
+		mediastart = mediastarts[0] if mediastarts else None,
+		empty = int(empty),
+	)
+
+def cut_patch(plans, trackorder, shift):
+	# patch for rewrite_atom: new tables and durations, per track in moov order
+	state = {'track': -1}
+
+	def duration_at(content, offsets, value):
+		# content with the duration field (32 or 64 bit, by version) replaced
+		data = content.str()
+		version = ord(data[0])
+		(at, fmt) = (offsets[1], '>Q') if (version == 1) else (offsets[0], '>I')
+		return data[:at] + struct.pack(fmt, value) + data[at+struct.calcsize(fmt):]
+
+	def patch(path, start, content):
+		type = path[-1]
+
+		if type == 'trak':
+			state['track'] += 1
+			return None
+
+		if type == 'mvhd':
+			return duration_at(content, (16, 24), max(plan.empty + plan.movieduration for plan in plans.values()))
+
+		plan = plans[trackorder[state['track']]]
+
+		if type == 'tkhd':
+			return duration_at(content, (20, 28), plan.empty + plan.movieduration)
+
+		elif type == 'mdhd':
+			return duration_at(content, (16, 24), plan.duration)
+
+		elif type == 'elst':
+			# the original's leading empty edit, then one edit over the whole
+			# cut, from the first presented sample
+			mediatime = plan.mediatime
+			if plan.begin == 0 and plan.mediastart is not None: # uncut start: keep the original's (encoder delay)
+				mediatime = plan.mediastart
+
+			edits = [(plan.movieduration, mediatime)]
+			if plan.empty:
+				edits.insert(0, (plan.empty, -1))
+			return fullbox(0, struct.pack('>I', len(edits)), ''.join(
+				struct.pack('>IiI', duration, start, 0x00010000)
+				for (duration, start) in edits
+			))
+
+		elif type == 'stts':
+			(starts, lengths) = runs(plan.deltas)
+			return fullbox(0, table('>u4', lengths, plan.deltas[starts]))
+
+		elif type == 'ctts':
+			(starts, lengths) = runs(plan.ctos)
+			version = 1 if (plan.ctos < 0).any() else 0
+			return fullbox(version, table('>i4', lengths, plan.ctos[starts]))
+
+		elif type == 'stss':
+			return fullbox(0, table('>u4', plan.keyframes))
+
+		elif type == 'stsz':
+			data = content.str()
+			samplesize = struct.unpack('>I', data[4:8])[0]
+			if samplesize:
+				return fullbox(0, struct.pack('>II', samplesize, len(plan.sizes)))
+			return fullbox(0, struct.pack('>I', 0), table('>u4', plan.sizes))
+
+		elif type == 'stsc':
+			(starts, lengths) = runs(plan.chunklengths, plan.chunkdescriptions)
+			return fullbox(0, table('>u4', starts + 1, plan.chunklengths[starts], plan.chunkdescriptions[starts]))
+
+		elif type in ('stco', 'co64'):
+			return chunk_offsets(shift(plan.chunkoffsets), wide=(type == 'co64'))
+
+		elif type == 'sdtp':
+			# a byte per sample
+			data = content.str()
+			return data[:4] + data[4+plan.begin:4+plan.end]
+
+		elif type in ('sbgp', 'sgpd', 'cslg', 'stps'):
+			return False # per-sample groupings that no longer line up
+
+		return None
+
+	return patch
+
+def byte_ranges(offsets, sizes, maxgap=2**16):
+	# sorted (starts, ends) covering the samples, merged across gaps up to maxgap
+	order = np.argsort(offsets, kind='mergesort')
+	(starts, ends) = (offsets[order], (offsets + sizes)[order])
+	if len(starts) == 0:
+		return (starts, ends)
+
+	ends = np.maximum.accumulate(ends)
+	new = np.append([True], starts[1:] > ends[:-1] + maxgap)
+	firsts = np.flatnonzero(new)
+	lasts = np.append(firsts[1:], len(starts)) - 1
+	return (starts[firsts], ends[lasts])
+
+def relocate(offsets, starts, outstarts):
+	# offsets inside the ranges at starts, moved to where the ranges go
+	i = np.searchsorted(starts, offsets, 'right') - 1
+	return offsets - starts[i] + outstarts[i]
+
+# ----------------------------------------------------------------------
+
+def cut(infname, outfname, start, end=None):
+	buf = FileBuffer(infname)
+	atoms = list(iter_atoms(buf))
+	types = [type for (atomstart, size, type, headersize) in atoms]
+	assert 'moof' not in types, "fragmented files are not supported"
+	assert types.count('moov') == 1
+
+	tree = mp4check.parse(buf, lazy=True)
+	tracks = mp4check.track_indexes(buf)
+	trackorder = [
+		select(atom.content, ['tkhd']).track_id
+		for atom in select(tree, ['moov'])
+		if atom.type == 'trak'
+	]
+	movietimescale = select(tree, ['moov', 'mvhd']).timescale
+
+	# reference track: video with keyframes, else the first
+	reference = tracks[trackorder[0]]
+	for track_id in trackorder:
+		if tracks[track_id].handler == 'vide' and not tracks[track_id].samples.keyframe.all():
+			reference = tracks[track_id]
+			break
+
+	# snap to keyframes: the one at or before start, the first at or after end
+	samples = reference.samples
+	first = samples.keyframe_at_time(start * samples.timescale) or 0
+	t0 = samples.dts[first] / samples.timescale
+
+	t1 = None
+	if end is not None:
+		keys = np.flatnonzero(samples.keyframe)
+		after = keys[samples.dts[keys] >= end * samples.timescale]
+		if len(after):
+			t1 = samples.dts[after[0]] / samples.timescale
+
+	plans = {}
+	for track_id in trackorder:
+		samples = tracks[track_id].samples
+		begin = np.searchsorted(samples.dts, t0 * samples.timescale, 'left')
+		stop = len(samples) if (t1 is None) else np.searchsorted(samples.dts, t1 * samples.timescale, 'left')
+		plans[track_id] = plan_track(tracks[track_id], int(begin), int(stop), movietimescale)
+
+	# the byte ranges of the kept samples, back to back in the output
+	(rangestarts, rangeends) = byte_ranges(
+		np.concatenate([tracks[track_id].samples.offset[plan.begin:plan.end] for (track_id, plan) in plans.items()]),
+		np.concatenate([tracks[track_id].samples.size[plan.begin:plan.end] for (track_id, plan) in plans.items()]))
+	rangeoutstarts = np.cumsum(rangeends - rangestarts) - (rangeends - rangestarts)
+	spansize = int((rangeends - rangestarts).sum())
+
+	ftyp = ''.join(buf[atomstart:atomstart+size].str() for (atomstart, size, type, headersize) in atoms if type == 'ftyp')
+	mdathead = struct.pack('>I4s', spansize + 8, 'mdat') if (spansize + 8 < 2**32) else struct.pack('>I4sQ', 1, 'mdat', spansize + 16)
+	(moovstart, moovsize, type, moovheadersize) = atoms[types.index('moov')]
+
+	# offsets depend on the moov's size, which can grow with co64
+	moovdata = ''
+	while True:
+		datastart = len(ftyp) + len(moovdata) + len(mdathead)
+		shift = lambda offsets: relocate(offsets, rangestarts, rangeoutstarts) + datastart
+		newmoov = rewrite_atom(buf, moovstart, moovsize, moovheadersize, 'moov', cut_patch(plans, trackorder, shift))
+
+		(moovdata, done) = (newmoov, len(newmoov) == len(moovdata))
+		if done:
+			break
+
+	with open(outfname, 'wb') as outfp:
+		outfp.write(ftyp + moovdata + mdathead)
+		outfp.flush()
+		for (start, end, outstart) in zip(rangestarts.tolist(), rangeends.tolist(), rangeoutstarts.tolist()):
+			copy_range(buf.source.fp, start, end - start, outfp, datastart + outstart)
+
+	return (t0, t1)
+
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	assert 3 <= len(args) <= 4, "mp4cut.py infile outfile start [end]"
+
+	(infname, outfname) = args[:2]
+	start = parse_time(args[2])
+	end = parse_time(args[3]) if (len(args) > 3) else None
+
+	assert not os.path.exists(outfname)
+
+	(t0, t1) = cut(infname, outfname, start, end)
+	print "cut %.3fs to %s" % (t0, "%.3fs" % t1 if (t1 is not None) else "end")
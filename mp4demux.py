@@ -0,0 +1,257 @@
+#!/usr/bin/env python2.7
+from __future__ import division
+import os
+import sys
+import struct
+import numpy as np
+
+import mp4check
+from mp4check import select
+from filetools import FileBuffer
+
+# elementary stream of one track, from the sample tables: AAC as ADTS,
+# H.264 as Annex-B. samples back to back in the file are handled as one run:
+# read once, headers or start codes put in, written once. nothing of it
+# passes through unchanged (a start code or header every few KB), so
+# copying in the kernel would only mean patching every page after.
+#
+# mp4demux.py [--audio | --video | --track=<id>] infile outfile
+#   outfile "-" is stdout. default: the video track, else the audio track
+
+startcode = '\x00\x00\x00\x01'
+
+def boxes(data):
+	# (type, body) of the atoms in a string
+	pos = 0
+	while pos + 8 <= len(data):
+		(size, type) = struct.unpack('>I4s', data[pos:pos+8])
+		headersize = 8
+		if size == 1:
+			(size,) = struct.unpack('>Q', data[pos+8:pos+16])
+			headersize = 16
+		elif size == 0:
+			size = len(data) - pos
+
+		if size < headersize:
+			break
+
+		yield (type, data[pos+headersize:pos+size])
+		pos += size
+
+def sample_entry_box(description, wanted):
+	# body of an atom inside a sample description (parse_stsd's remainder)
+	data = description.remainder.str() if ('remainder' in description) else ''
+	for (type, body) in boxes(data):
+		if type == wanted:
+			return body
+		if type == 'wave': # quicktime sound description v1
+			for (subtype, subbody) in boxes(body):
+				if subtype == wanted:
+					return subbody
+
+	assert False, "no %s in the %s sample description" % (wanted, description.format)
+
+def descriptors(data):
+	# (tag, body) of MPEG-4 descriptors (ISO 14496-1), sizes 7 bits per byte
+	pos = 0
+	while pos + 2 <= len(data):
+		tag = ord(data[pos])
+		pos += 1
+
+		size = 0
+		while True:
+			byte = ord(data[pos])
+			pos += 1
+			size = (size << 7) | (byte & 0x7F)
+			if not (byte & 0x80):
+				break
+
+		yield (tag, data[pos:pos+size])
+		pos += size
+
+def aac_config(esds):
+	# (object type, sampling frequency index, channels) of the AudioSpecificConfig
+	for (tag, es) in descriptors(esds[4:]):
+		if tag != 0x03: # ES_Descriptor
+			continue
+
+		flags = ord(es[2])
+		pos = 3
+		if flags & 0x80: pos += 2 # depends on ES_ID
+		if flags & 0x40: pos += 1 + ord(es[pos]) # URL
+		if flags & 0x20: pos += 2 # OCR ES_ID
+
+		for (tag, decoderconfig) in descriptors(es[pos:]):
+			if tag != 0x04: # DecoderConfigDescriptor
+				continue
+
+			for (tag, specific) in descriptors(decoderconfig[13:]):
+				if tag == 0x05: # DecoderSpecificInfo
+					(bits,) = struct.unpack('>H', specific[:2])
+					return (bits >> 11, (bits >> 7) & 0xF, (bits >> 3) & 0xF)
+
+	assert False, "no AudioSpecificConfig in esds"
+
+def adts_headers(config, sizes):
+	# 7 byte ADTS header (no CRC) per frame, as rows
+	(objecttype, freqindex, channels) = config
+	assert 1 <= objecttype <= 4, "no ADTS profile for audio object type %d" % objecttype
+	assert freqindex < 15 and channels < 8, "explicit frequency or channel layout, no ADTS for that"
+
+	lengths = sizes + 7
+	assert (lengths < 2**13).all()
+
+	headers = np.empty((len(sizes), 7), dtype=np.uint8)
+	headers[:,0] = 0xFF
+	headers[:,1] = 0xF1 # MPEG-4, layer 0, no CRC
+	headers[:,2] = ((objecttype - 1) << 6) | (freqindex << 2) | (channels >> 2)
+	headers[:,3] = ((channels & 3) << 6) | (lengths >> 11)
+	headers[:,4] = (lengths >> 3) & 0xFF
+	headers[:,5] = ((lengths & 7) << 5) | 0x1F # buffer fullness 0x7FF: variable rate
+	headers[:,6] = 0xFC
+	return headers
+
+# ----------------------------------------------------------------------
+
+def runs(samples, breaks=None, maxsize=2**24):
+	# (first, stop) ranges of samples back to back in the file, split before
+	# breaks, and at maxsize bytes unless one sample is bigger
+	n = len(samples)
+	split = np.ones(n, dtype=bool)
+	split[1:] = (samples.offset[1:] != samples.offset[:-1] + samples.size[:-1])
+	if breaks is not None:
+		split |= breaks
+
+	starts = np.flatnonzero(split).tolist() + [n]
+	ends = np.cumsum(samples.size)
+
+	for (first, stop) in zip(starts[:-1], starts[1:]):
+		while first < stop:
+			base = ends[first] - samples.size[first]
+			last = int(np.searchsorted(ends, base + maxsize, 'right'))
+			last = min(max(last, first + 1), stop)
+			yield (first, last)
+			first = last
+
+def demux_aac(buf, samples, description, out):
+	headers = adts_headers(aac_config(sample_entry_box(description, 'esds')), samples.size)
+
+	for (first, stop) in runs(samples):
+		start = int(samples.offset[first])
+		data = buf[start:int(samples.offset[stop-1] + samples.size[stop-1])].str()
+
+		pieces = []
+		for (i, offset, size) in zip(xrange(first, stop), samples.offset[first:stop].tolist(), samples.size[first:stop].tolist()):
+			pieces.append(headers[i].tostring())
+			pieces.append(data[offset-start:offset-start+size])
+		out.write(''.join(pieces))
+
+def nal_units(data, lengthsize, at=0):
+	# offsets of the length fields in data, and the NAL unit types.
+	# at: where data is in the file, for the error
+	fmt = {1: '>B', 2: '>H', 4: '>I'}[lengthsize]
+	(offsets, types) = ([], [])
+
+	pos = 0
+	while pos < len(data):
+		(size,) = struct.unpack_from(fmt, data, pos)
+		offsets.append(pos)
+		types.append(ord(data[pos + lengthsize]) & 0x1F)
+		pos += lengthsize + size
+
+	assert pos == len(data), "NAL unit lengths overrun the sample at %d" % at
+	return (offsets, types)
+
+def demux_avc(buf, samples, description, out):
+	avcc = description.avcC
+	lengthsize = avcc.lengthsize
+	parameters = ''.join(startcode + unit for unit in avcc.sps + avcc.pps)
+
+	# parameter sets go before every keyframe, unless the stream has its own
+	if len(samples) and samples.keyframe.any():
+		keyframe = int(np.flatnonzero(samples.keyframe)[0])
+		start = int(samples.offset[keyframe])
+		(offsets, types) = nal_units(buf[start:start+int(samples.size[keyframe])].str(), lengthsize, start)
+		if 7 in types: # SPS
+			parameters = ''
+
+	for (first, stop) in runs(samples, samples.keyframe if parameters else None):
+		start = int(samples.offset[first])
+		end = int(samples.offset[stop-1] + samples.size[stop-1])
+		data = buf[start:end].str()
+		(offsets, types) = nal_units(data, lengthsize, start)
+
+		if parameters and samples.keyframe[first]:
+			out.write(parameters)
+
+		if lengthsize == len(startcode):
+			# same size: start codes over the lengths
+			data = bytearray(data)
+			for offset in offsets:
+				data[offset:offset+lengthsize] = startcode
+			out.write(data)
+		else:
+			out.write(''.join(
+				startcode + data[offset+lengthsize:nextoffset]
+				for (offset, nextoffset) in zip(offsets, offsets[1:] + [len(data)])
+			))
+
+demuxers = {
+	'mp4a': demux_aac,
+	'avc1': demux_avc,
+	'avc3': demux_avc,
+}
+
+def demux(fname, outfp, track_id=None, handler=None):
+	# writes the track (by id, else the first with that handler) to outfp
+	buf = FileBuffer(fname, mmap=True)
+	tracks = mp4check.track_indexes(buf)
+
+	if track_id is None:
+		matching = [track_id for track_id in sorted(tracks) if tracks[track_id].handler == handler]
+		assert matching, "no %s track" % handler
+		track_id = matching[0]
+
+	track = tracks[track_id]
+	descriptions = select(track.trak, ['mdia', 'minf', 'stbl', 'stsd'])
+	description = descriptions[0]
+	assert description.format in demuxers, "can't demux %s" % description.format
+
+	demuxers[description.format](buf, track.samples, description, outfp)
+	outfp.flush()
+
+	return (track, description.format)
+
+if __name__ == '__main__':
+	flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+	args = [arg for arg in sys.argv[1:] if arg not in flags]
+	assert len(args) == 2, "mp4demux.py [--audio | --video | --track=<id>] infile outfile"
+
+	(infname, outfname) = args
+
+	track_id = None
+	handler = None
+	for flag in flags:
+		if flag.startswith('--track='):
+			track_id = int(flag.split('=', 1)[1])
+		elif flag == '--audio':
+			handler = 'soun'
+		elif flag == '--video':
+			handler = 'vide'
+		else:
+			assert False, "unknown flag %s" % flag
+
+	if track_id is None and handler is None:
+		handlers = [track.handler for track in mp4check.track_indexes(FileBuffer(infname)).values()]
+		handler = 'vide' if ('vide' in handlers) else 'soun'
+
+	if outfname == '-':
+		outfp = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+	else:
+		assert not os.path.exists(outfname)
+		outfp = open(outfname, 'wb')
+
+	with outfp:
+		(track, format) = demux(infname, outfp, track_id, handler)
+
+	sys.stderr.write("track %d (%s): %d samples, %d bytes\n" % (track.track_id, format, len(track.samples), track.samples.size.sum()))
@@ -8,6 +8,7 @@ from subprocess import call, Popen, PIPE
 
 import json
 import mp4select
+import mp4check
 import xmpmarkers
 import ffmeta
 
@@ -49,4 +50,6 @@ ffmeta.write_jumplist(chapters, open(jumplist, 'w'))
 for invid in files:
 	outvid = invid.replace('-ame', '')
 	assert not os.path.exists(outvid)
-	call(['ffmpeg', '-i', invid, '-i', ffmetafile, '-c', 'copy', '-movflags', 'faststart', outvid])
+	# chapters need the remux; the index is moved after that, without a second ffmpeg pass
+	if call(['ffmpeg', '-i', invid, '-i', ffmetafile, '-c', 'copy', outvid]) == 0:
+		mp4check.faststart(outvid)
@@ -6,7 +6,7 @@ import shutil
 import re
 import pprint; pp = pprint.pprint
 
-from filetools import Buffer, FileBuffer, BufferReader
+from filetools import Buffer, FileBuffer, PipeBuffer, BufferReader
 
 __all__ = 'select dump match FileBuffer'.split()
 
@@ -25,7 +25,7 @@ crumbrex = re.compile(r'''
 
 def walk_boxes(buf):
 	p = 0
-	while p < len(buf):
+	while buf.has(p):
 		(boxlen, boxcode) = buf[p:][">I4s"]
 		contentoffset = 8
 		
@@ -34,8 +34,9 @@ def walk_boxes(buf):
 			boxlen = buf[p+8:][">Q"]
 			contentoffset = 16
 
-		if boxlen == 0: # extends to end of file
-			boxlen = len(buf) - p
+		if boxlen == 0: # extends to end of file. open-ended: streams aren't read to the end here
+			yield boxcode, buf[p+contentoffset:]
+			return
 
 		box = buf[p+contentoffset : p+boxlen]
 		
@@ -129,7 +130,7 @@ if __name__ == '__main__':
 	
 	args = []
 	for arg in sys.argv[1:]:
-		if arg.startswith('-'):
+		if arg.startswith('-') and arg != '-': # '-' is stdin
 			if arg == '-m':
 				domatch = True
 			if arg == '-d':
@@ -142,7 +143,10 @@ if __name__ == '__main__':
 
 	(selector, fname) = args
 
-	filebuf = FileBuffer(fname)
+	if fname == '-':
+		filebuf = PipeBuffer(sys.stdin)
+	else:
+		filebuf = FileBuffer(fname)
 	
 	if dodump:
 		for box in select(selector, filebuf):
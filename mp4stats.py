@@ -0,0 +1,127 @@
+#!/usr/bin/env python2.7
+from __future__ import division
+import os
+import sys
+import glob
+import json
+import numpy as np
+
+import mp4check
+from filetools import FileBuffer
+
+# bitrate over time and GOP structure, from the sample tables alone.
+# no media data is read.
+#
+# mp4stats.py [--csv] files...
+#   json summary on stdout, per file and track
+#   --csv: also, next to each file, "<file>-track<id>.csv" with a row per
+#          second and "<file>-track<id>-gops.csv" with a row per GOP
+
+def summary(values):
+	if len(values) == 0:
+		return None
+
+	def plain(value, digits):
+		value = value.item()
+		return round(value, digits) if isinstance(value, float) else value
+
+	return {
+		'count': len(values),
+		'min': plain(values.min(), 6),
+		'max': plain(values.max(), 6),
+		'mean': plain(values.mean(), 3),
+	}
+
+def per_second(samples):
+	# (bytes, samples, keyframes) per second of decode time
+	seconds = samples.dts // samples.timescale
+	nseconds = int(seconds.max()) + 1 if len(samples) else 0
+
+	nbytes    = np.bincount(seconds, weights=samples.size, minlength=nseconds).astype(np.int64)
+	nsamples  = np.bincount(seconds, minlength=nseconds)
+	keyframes = np.bincount(seconds, weights=samples.keyframe, minlength=nseconds).astype(np.int64)
+
+	return (nbytes, nsamples, keyframes)
+
+def gops(samples):
+	# (start time, samples, bytes, seconds) per GOP.
+	# samples before the first keyframe count as one
+	if len(samples) == 0:
+		return (np.zeros(0),) * 4
+
+	starts = np.flatnonzero(samples.keyframe)
+	if len(starts) == 0 or starts[0] != 0:
+		starts = np.insert(starts, 0, 0)
+
+	ends = np.append(starts[1:], len(samples))
+	endtimes = np.append(samples.dts, samples.duration)[ends]
+
+	return (
+		samples.dts[starts] / samples.timescale,
+		ends - starts,
+		np.add.reduceat(samples.size, starts),
+		(endtimes - samples.dts[starts]) / samples.timescale
+	)
+
+def analyze(track):
+	samples = track.samples
+	(nbytes, nsamples, keyframes) = per_second(samples)
+	(gopstarts, goplengths, gopbytes, gopdurations) = gops(samples)
+
+	span = (samples.duration - samples.dts[0]) / samples.timescale if len(samples) else 0
+	if samples.duration % samples.timescale:
+		nbytes = nbytes[:-1] # the last second is partial
+	keytimes = samples.dts[samples.keyframe] / samples.timescale
+
+	return {
+		'track_id': track.track_id,
+		'handler': track.handler,
+		'timescale': samples.timescale,
+		'samples': len(samples),
+		'keyframes': int(samples.keyframe.sum()),
+		'duration': span,
+		'bytes': int(samples.size.sum()),
+		'bitrate': round(samples.size.sum() * 8 / span, 1) if span else None,
+		'bits_per_second': summary(nbytes * 8),
+		'gop_samples': summary(goplengths),
+		'gop_seconds': summary(gopdurations),
+		'gop_bytes': summary(gopbytes),
+		'keyframe_interval': summary(np.diff(keytimes)),
+	}
+
+def write_csv(basename, track):
+	(nbytes, nsamples, keyframes) = per_second(track.samples)
+
+	with open(basename + '.csv', 'w') as fh:
+		fh.write('second,bits,samples,keyframes\n')
+		for (second, row) in enumerate(zip(nbytes * 8, nsamples, keyframes)):
+			fh.write('%d,%d,%d,%d\n' % ((second,) + row))
+
+	with open(basename + '-gops.csv', 'w') as fh:
+		fh.write('start,samples,bytes,seconds\n')
+		for row in zip(*gops(track.samples)):
+			fh.write('%.3f,%d,%d,%.3f\n' % row)
+
+if __name__ == '__main__':
+	flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+	docsv = ('--csv' in flags)
+
+	fnames = []
+	for globbable in sys.argv[1:]:
+		if globbable in flags: continue
+		fnames += glob.glob(globbable)
+
+	data = []
+	for fname in fnames:
+		tracks = mp4check.track_indexes(FileBuffer(fname))
+
+		data.append({
+			'file': fname,
+			'tracks': [analyze(tracks[track_id]) for track_id in sorted(tracks)],
+		})
+
+		if docsv:
+			for track_id in sorted(tracks):
+				write_csv('%s-track%d' % (os.path.splitext(fname)[0], track_id), tracks[track_id])
+
+	print json.dumps(data, sort_keys=True, indent=1)
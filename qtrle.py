@@ -50,7 +50,7 @@ def ilen(seq):
 def decode_chunk(frame, chunk, update=False):
 	pixfmtstr = {'argb': '>BBBB', 'rgb24': '>BBB'}[pixfmt]
 
-	chunk = chunk.copy()
+	chunk = chunk.cursor()
 	xmax = ymax = 0
 	header = (chunk >> ">H") # header 0x0008 means decode starting at some line other than 0
 
@@ -188,7 +188,7 @@ if __name__ == '__main__':
 	totalframes = None
 
 	# read input file
-	buf = FileBuffer(infname)
+	buf = FileBuffer(infname, prefetch=True)
 	(mdat,) = mp4select.select("mdat", buf)
 
 	# check for MOOV, MDHD (for time base), STSD (spatial metadata), STTS (frame durations), STSS (keyframes)
@@ -196,7 +196,7 @@ if __name__ == '__main__':
 	if got_moov:
 		try:
 			import mp4check
-			tree = mp4check.parse(buf)
+			tree = mp4check.parse(buf, lazy=True)
 
 			# mdhd.scale
 			mdhd = mp4check.select(tree, 'moov.trak.mdia.mdhd'.split('.'))
@@ -302,3 +302,5 @@ if __name__ == '__main__':
 
 		if dobreak:
 			break
+
+	buf.close()
@@ -79,7 +79,7 @@ class Chunkgen(object):
 
 class BytesSource(object):
 	def __init__(self, firstbuf, chunkgen):
-		self.chunk = firstbuf
+		self.chunk = firstbuf.cursor()
 		self.chunkgen = chunkgen
 	
 	def read(self, toread):
@@ -93,26 +93,24 @@ class BytesSource(object):
 					break
 				else:
 					(ts,buf) = self.chunk
-					self.chunk = buf
+					self.chunk = buf.cursor()
 
-			if toread >= len(self.chunk):
-				res.append(self.chunk)
-				toread -= len(self.chunk)
+			remaining = len(self.chunk) - self.chunk.pos
+			if toread >= remaining:
+				res.append(self.chunk.read())
+				toread -= remaining
 				self.chunk = None
 			else:
-				buf = self.chunk[:toread]
-				self.chunk = self.chunk[toread:]
-				res.append(buf)
-				toread -= len(buf)
-				assert toread == 0
+				res.append(self.chunk.read(toread))
+				toread = 0
 
-		return "".join(buf.str() for buf in res)
+		return "".join(res)
 	
 	def __rshift__(self, fmt):
-		fmtlen = struct.calcsize(fmt)
-		data = self.read(fmtlen)
-		assert len(data) == fmtlen
-		res = struct.unpack(fmt, data)
+		st = getstruct(fmt)
+		data = self.read(st.size)
+		assert len(data) == st.size
+		res = st.unpack(data)
 		if len(res) == 1:
 			(res,) = res
 		return res
@@ -296,7 +294,7 @@ if __name__ == '__main__':
 	croph = 768
 	
 
-	buf = FileBuffer(fname)
+	buf = FileBuffer(fname, prefetch=True)
 	
 	t0 = time.time()
 	
@@ -411,3 +409,5 @@ if __name__ == '__main__':
 		
 		outvid.write(framebuf[:croph,:cropw])
 		currentframe += 1
+
+	buf.close()
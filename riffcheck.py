@@ -601,7 +601,11 @@ def parse_bext(chunk, block, indent):
 
 if __name__ == '__main__':
 	fnames = []
+	flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+	iostats = ('--io-stats' in flags)
+
 	for globbable in sys.argv[1:]:
+		if globbable in flags: continue
 		fnames += glob.glob(globbable)
 
 	for fname in fnames:
@@ -610,7 +614,8 @@ if __name__ == '__main__':
 		print fname
 		#print
 
-		fb = FileBuffer(fname)
+		stats = IOStats() if iostats else None
+		fb = FileBuffer(fname, stats=stats)
 
 		status = 0
 		tree = None
@@ -626,6 +631,9 @@ if __name__ == '__main__':
 			print 'file looks okay'
 			#print
 
+		if stats:
+			print stats.report()
+
 		# clean up previous statuses
 		for x in glob.glob(os.path.abspath(fname) + sig + "*"):
 			os.unlink(x)
@@ -79,8 +79,7 @@ sampling_rate = wave.open(audiofile).getframerate()
 print "sampling rate:", sampling_rate
 
 assert os.path.isfile(audiofile)
-fb = FileBuffer(audiofile, 'r+b' if dopatch else 'rb')
-fp = fb.fp # needed for patching
+fb = FileBuffer(audiofile, 'r+b' if dopatch else 'rb', journal=dopatch)
 tree = parse_riff_file(fb)
 
 labelchunks = tree.getchunks(('LIST', 'adtl'), ('list', 'adtl'))
@@ -159,22 +158,23 @@ adtlchunk = packchunk("LIST", "adtl",
 if dopatch:
 	raw_input("hit enter to continue")
 
+	# patches are collected, then committed in one go with an undo journal
+
 	# just overwrite outdated chunks
 	tokill = tree.getchunks('cue ', ('LIST', 'adtl'), ('list', 'adtl'))
 	for chunk in tokill:
-		fp.seek(chunk.start)
-		fp.write(packchunk("JUNK", (chunk.length - 8) * '\x00'))
-
-	fp.seek(4)
-	(oldlen,) = struct.unpack("I", fp.read(4))
-	fp.seek(0, os.SEEK_END)
-	assert oldlen == fp.tell() - 8
-
-	fp.write(cuechunk)
-	fp.write(adtlchunk)
-	newlen = fp.tell()
-	fp.seek(4)
-	fp.write(struct.pack("I", newlen - 8))
+		fb.source.write(chunk.start, packchunk("JUNK", (chunk.length - 8) * '\x00'))
+
+	oldlen = fb[4:8]["I"]
+	assert oldlen == len(fb) - 8
+
+	# append
+	newchunks = cuechunk + adtlchunk
+	fb.source.write(len(fb), newchunks)
+	newlen = len(fb) + len(newchunks)
+	fb[4:8]["I"] = newlen - 8
+
+	fb.commit()
 
 # TODO
 #	* open as r+ for patching
@@ -0,0 +1,73 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import unittest
+import subprocess
+from distutils.spawn import find_executable
+
+# the tools live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mp4check
+mp4check.verbose = False
+
+# test media is made with ffmpeg: 4 s of 160x120 at 25 fps, a keyframe
+# every second, B-frames (ctts, a start delay in the edit list), and 4 s of
+# AAC. made once per run, in a directory removed at exit
+
+ffmpeg = find_executable('ffmpeg')
+needs_ffmpeg = unittest.skipIf(ffmpeg is None, "needs ffmpeg")
+
+workdir = tempfile.mkdtemp(prefix='videozeug-tests-')
+atexit.register(shutil.rmtree, workdir, True)
+
+made = {}
+
+def media(name='plain', seconds=4, frequency=440):
+	# path of a test file. name: 'plain' (moov at the end), 'fragmented'
+	movflags = {
+		'plain': [],
+		'fragmented': ['-movflags', 'frag_keyframe+empty_moov'],
+	}[name]
+
+	key = (name, seconds, frequency)
+	if key not in made:
+		fname = os.path.join(workdir, '%s-%d-%d.mp4' % key)
+		subprocess.check_call([
+			ffmpeg, '-v', 'error', '-y',
+			'-f', 'lavfi', '-i', 'testsrc=duration=%d:size=160x120:rate=25' % seconds,
+			'-f', 'lavfi', '-i', 'sine=frequency=%d:duration=%d:sample_rate=44100' % (frequency, seconds),
+			'-c:v', 'libx264', '-g', '25', '-bf', '2', '-pix_fmt', 'yuv420p',
+			'-c:a', 'aac',
+			'-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+			'-map_metadata', '-1',
+		] + movflags + [fname])
+		made[key] = fname
+
+	return made[key]
+
+def scratch(name):
+	# path for an output file, not yet there
+	fname = os.path.join(workdir, name)
+	if os.path.exists(fname):
+		os.unlink(fname)
+	return fname
+
+def copy(fname, name):
+	# a copy to modify
+	target = scratch(name)
+	shutil.copyfile(fname, target)
+	return target
+
+def packet_hashes(fname, stream='v:0', decode=False):
+	# md5 per packet (or per decoded frame) of a stream, as ffmpeg sees it
+	codec = [] if decode else ['-c', 'copy']
+	output = subprocess.check_output([
+		ffmpeg, '-v', 'error', '-i', fname, '-map', '0:' + stream] + codec + ['-f', 'framemd5', '-'])
+	return [
+		line.split(',')[5].strip() # stream, dts, pts, duration, size, hash[, side data]
+		for line in output.splitlines()
+		if line and not line.startswith('#')
+	]
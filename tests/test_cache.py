@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+import cPickle as pickle
+import numpy as np
+
+from fixtures import mp4check, media, copy, scratch, workdir, needs_ffmpeg
+from filetools import FileBuffer
+
+def without_udta(fname):
+	# parse() asserts on ffmpeg's metadata handler ('mdir'); out of the way with it
+	tree = mp4check.parse(FileBuffer(fname), lazy=True)
+	udtas = [atom for atom in mp4check.select(tree, ['moov']) if atom.type == 'udta']
+	with open(fname, 'r+b') as fh:
+		for atom in udtas:
+			fh.seek(atom.start + 4)
+			fh.write('free')
+	return fname
+
+class TestCache(unittest.TestCase):
+	def assertSameTree(self, a, b, path=''):
+		if isinstance(a, np.ndarray):
+			self.assertEqual((a.dtype, a.shape), (b.dtype, b.shape), path)
+			self.assertTrue((a == b).all(), path)
+		elif isinstance(a, mp4check.Atom):
+			self.assertEqual((a.start, a.length, a.type), (b.start, b.length, b.type), path)
+			self.assertSameTree(a.content, b.content, path + '/' + a.type)
+		elif isinstance(a, mp4check.SampleIndex):
+			for name in ('offset', 'size', 'dts', 'cts', 'keyframe'):
+				self.assertSameTree(getattr(a, name), getattr(b, name), path + '.' + name)
+			self.assertEqual((a.timescale, a.lastdelta), (b.timescale, b.lastdelta), path)
+		elif isinstance(a, mp4check.Buffer):
+			self.assertEqual(a.str(), b.str(), path)
+		elif isinstance(a, dict):
+			self.assertEqual(type(a), type(b), path)
+			self.assertEqual(list(a.keys()), list(b.keys()), path)
+			for key in a:
+				self.assertSameTree(a[key], b[key], '%s.%s' % (path, key))
+		elif isinstance(a, (list, tuple)):
+			self.assertEqual((type(a), len(a)), (type(b), len(b)), path)
+			for (x, y) in zip(a, b):
+				self.assertSameTree(x, y, path)
+		else:
+			self.assertEqual((type(a), a), (type(b), b), path)
+
+	@needs_ffmpeg
+	def test_cached_equals_parsed(self):
+		fname = without_udta(copy(media(), 'cached.mp4'))
+		cachedir = tempfile.mkdtemp(dir=workdir)
+
+		parsed = mp4check.cached_parse(fname, cachedir)
+		cachename = mp4check.cache_name(fname, cachedir)
+		self.assertTrue(os.path.exists(cachename))
+
+		loaded = mp4check.load_index(fname, cachename)
+		self.assertNotEqual(loaded, None)
+		self.assertSameTree(parsed, loaded)
+
+		# stale once the file changes
+		os.utime(fname, (0, 0))
+		self.assertEqual(mp4check.load_index(fname, cachename), None)
+
+	@needs_ffmpeg
+	def test_foreign_cache_ignored(self):
+		fname = without_udta(copy(media(), 'foreign.mp4'))
+		mp4check.cached_parse(fname)
+		cachename = mp4check.cache_name(fname)
+
+		os.chmod(cachename, 0664) # someone else could have written it
+		self.assertEqual(mp4check.load_index(fname), None)
+
+	def test_no_pickle(self):
+		# a cache file holding a pickle that would run code, if unpickled
+		fname = scratch('pickled.mp4')
+		with open(fname, 'wb') as fh:
+			fh.write('x' * 100)
+		marker = scratch('pickle-ran')
+
+		class Payload(object):
+			def __reduce__(self):
+				return (open, (marker, 'w'))
+
+		tree = pickle.dumps(Payload(), 2)
+		st = os.stat(fname)
+		head = mp4check.cachemagic + mp4check.cachehead.pack(st.st_ino, st.st_size, st.st_mtime, len(tree))
+		with open(fname + '.mp4idx', 'wb') as fh:
+			fh.write(head + tree)
+		os.chmod(fname + '.mp4idx', 0644)
+
+		with self.assertRaises(ValueError):
+			mp4check.load_index(fname)
+		self.assertFalse(os.path.exists(marker))
+
+if __name__ == '__main__':
+	unittest.main()
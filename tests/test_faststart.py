@@ -0,0 +1,49 @@
+import os
+import unittest
+
+from fixtures import mp4check, media, copy, scratch, packet_hashes, needs_ffmpeg
+from filetools import FileBuffer
+
+def types(fname):
+	return [type for (start, size, type, headersize) in mp4check.iter_atoms(FileBuffer(fname))]
+
+@needs_ffmpeg
+class TestFaststart(unittest.TestCase):
+	def test_to_new_file(self):
+		outfname = scratch('faststart.mp4')
+		self.assertTrue(mp4check.faststart(media(), outfname))
+		self.assertEqual(types(media())[-1], 'moov')
+		self.assertEqual(types(outfname)[:2], ['ftyp', 'moov'])
+		self.assertEqual(os.path.getsize(outfname), os.path.getsize(media()))
+
+		for stream in ('v:0', 'a:0'):
+			self.assertEqual(packet_hashes(outfname, stream), packet_hashes(media(), stream))
+
+		self.assertFalse(mp4check.faststart(outfname)) # already is
+
+	def test_in_place(self):
+		# ffmpeg leaves a free atom before mdat, too small for the moov: through a copy
+		fname = copy(media(), 'inplace.mp4')
+		self.assertTrue(mp4check.faststart(fname))
+		self.assertEqual(types(fname)[:2], ['ftyp', 'moov'])
+		self.assertEqual(packet_hashes(fname, 'v:0'), packet_hashes(media(), 'v:0'))
+		self.assertFalse(os.path.exists(fname + '.faststart'))
+
+	def test_fragmented_refused(self):
+		# moov first already: nothing to do. moved behind the fragments: refused
+		self.assertFalse(mp4check.faststart(media('fragmented')))
+
+		atoms = list(mp4check.iter_atoms(FileBuffer(media('fragmented'))))
+		with open(media('fragmented'), 'rb') as fh:
+			data = fh.read()
+		reordered = ''.join(data[start:start+size] for (start, size, type, headersize) in atoms if type != 'moov')
+		reordered += ''.join(data[start:start+size] for (start, size, type, headersize) in atoms if type == 'moov')
+
+		fname = scratch('moovlast.mp4')
+		with open(fname, 'wb') as fh:
+			fh.write(reordered)
+		with self.assertRaises(AssertionError):
+			mp4check.faststart(fname)
+
+if __name__ == '__main__':
+	unittest.main()
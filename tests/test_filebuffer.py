@@ -0,0 +1,71 @@
+import os
+import threading
+import unittest
+import numpy as np
+
+from fixtures import scratch
+import filebuffer
+from filetools import FileBuffer
+
+data = np.arange(2**18, dtype='>u4').tostring() # 1 MB
+
+def make(name):
+	fname = scratch(name)
+	with open(fname, 'wb') as fh:
+		fh.write(data)
+	return fname
+
+class Failing(object):
+	# a source whose reads of one block fail, once
+	def __init__(self, source, offset):
+		self.source = source
+		self.fp = source.fp
+		self.offset = offset
+
+	def read(self, offset, nbytes):
+		if offset == self.offset:
+			self.offset = None
+			raise IOError("bad block")
+		return self.source.read(offset, nbytes)
+
+class TestFileBuffer(unittest.TestCase):
+	def test_sources_agree(self):
+		fname = make('sources.bin')
+		for options in ({}, {'mmap': True}, {'cache': True}, {'prefetch': True}):
+			with FileBuffer(fname, **options) as buf:
+				self.assertEqual(buf[1000:1016].str(), data[1000:1016], options)
+				self.assertEqual(buf[4:][">I"], 1, options)
+				self.assertEqual(buf[2**19:].as_array('>u4', 4).tolist(), range(2**17, 2**17 + 4), options)
+
+	def test_arrays_outlive_mapped_buffer(self):
+		fname = make('mapped.bin')
+		buf = FileBuffer(fname, mmap=True)
+		array = buf[2**19:].as_array('>u4')
+		buf.close()
+		self.assertEqual(array[-1], 2**18 - 1)
+
+	def test_close_stops_prefetching(self):
+		fname = make('prefetch.bin')
+		before = threading.active_count()
+		buf = FileBuffer(fname, prefetch=True)
+		self.assertEqual(threading.active_count(), before + 1)
+		buf[0:10].str()
+		buf.close()
+		self.assertEqual(threading.active_count(), before)
+		self.assertTrue(buf.fp.closed)
+
+	def test_prefetch_error_reaches_reader(self):
+		fname = make('failing.bin')
+		with open(fname, 'rb') as fp:
+			blocksize = 2**16
+			source = filebuffer.PrefetchSource(
+				Failing(filebuffer.FileSource(fp), blocksize), len(data), blocksize=blocksize)
+			try:
+				with self.assertRaises(IOError):
+					source.read(blocksize + 10, 10)
+				self.assertEqual(source.read(blocksize + 10, 10), data[blocksize+10 : blocksize+20])
+			finally:
+				source.close()
+
+if __name__ == '__main__':
+	unittest.main()
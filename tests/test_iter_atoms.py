@@ -0,0 +1,66 @@
+import os
+import struct
+import unittest
+
+from fixtures import mp4check, scratch
+from filetools import FileBuffer, PipeBuffer
+
+def atom(type, body):
+	return struct.pack('>I4s', 8 + len(body), type) + body
+
+def write(name, data):
+	fname = scratch(name)
+	with open(fname, 'wb') as fh:
+		fh.write(data)
+	return fname
+
+def atoms_of(data, **kw):
+	return list(mp4check.iter_atoms(FileBuffer(write('atoms.mp4', data)), **kw))
+
+class TestIterAtoms(unittest.TestCase):
+	def test_headers(self):
+		data = atom('ftyp', 'isom' * 3) + atom('free', '') + atom('mdat', 'x' * 100)
+		self.assertEqual(atoms_of(data), [
+			(0, 20, 'ftyp', 8),
+			(20, 8, 'free', 8),
+			(28, 108, 'mdat', 8),
+		])
+
+	def test_largesize(self):
+		data = atom('ftyp', 'isom') + struct.pack('>I4sQ', 1, 'mdat', 16 + 50) + 'x' * 50
+		self.assertEqual(atoms_of(data), [(0, 12, 'ftyp', 8), (12, 66, 'mdat', 16)])
+
+	def test_size_zero_runs_to_the_end(self):
+		data = atom('ftyp', 'isom') + struct.pack('>I4s', 0, 'mdat') + 'x' * 50
+		self.assertEqual(atoms_of(data), [(0, 12, 'ftyp', 8), (12, 58, 'mdat', 8)])
+
+	def test_cut_short(self):
+		data = atom('ftyp', 'isom') + atom('mdat', 'x' * 100)[:60]
+		with self.assertRaises(mp4check.AtomIncomplete):
+			atoms_of(data)
+
+		self.assertEqual(atoms_of(data, clip=True), [(0, 12, 'ftyp', 8), (12, 60, 'mdat', 8)])
+
+	def test_sizes_below_the_header(self):
+		# would never advance
+		for data in (struct.pack('>I4s', 4, 'free') + 'x' * 20, struct.pack('>I4sQ', 1, 'mdat', 8) + 'x' * 20):
+			with self.assertRaises(mp4check.AtomIncomplete):
+				atoms_of(data)
+
+	def test_stream(self):
+		# a size-0 atom on a pipe isn't read to the end to find its size
+		data = atom('ftyp', 'isom') + atom('moov', 'y' * 20) + struct.pack('>I4s', 0, 'mdat') + 'x' * 2**20
+		(read, write) = os.pipe()
+		os.write(write, data[:1000])
+
+		buf = PipeBuffer(os.fdopen(read, 'rb'))
+		atoms = mp4check.iter_atoms(buf)
+		self.assertEqual(next(atoms), (0, 12, 'ftyp', 8))
+		self.assertEqual(next(atoms), (12, 28, 'moov', 8))
+		with self.assertRaises(AssertionError):
+			next(atoms)
+		self.assertTrue(buf.source.size <= 1000)
+		os.close(write)
+
+if __name__ == '__main__':
+	unittest.main()
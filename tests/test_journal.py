@@ -0,0 +1,93 @@
+import os
+import struct
+import unittest
+
+from fixtures import scratch
+import filebuffer
+from filetools import FileBuffer
+
+original = ''.join(chr(i % 251) for i in xrange(10000))
+
+def make(name):
+	fname = scratch(name)
+	with open(fname, 'wb') as fh:
+		fh.write(original)
+	return fname
+
+def contents(fname):
+	with open(fname, 'rb') as fh:
+		return fh.read()
+
+class Crash(Exception):
+	pass
+
+class TestJournal(unittest.TestCase):
+	def test_reads_see_patches(self):
+		fname = make('overlay.bin')
+		with FileBuffer(fname, 'r+b', journal=True) as buf:
+			buf.source.write(100, 'abcd')
+			buf.source.write(102, 'XY')
+			buf.source.write(9998, 'tail')
+			self.assertEqual(buf.source.read(98, 8), original[98:100] + 'abXY' + original[104:106])
+			self.assertEqual(buf.source.read(9996, 10), original[9996:9998] + 'tail')
+
+			self.assertEqual(contents(fname), original) # nothing written yet
+
+	def test_commit(self):
+		fname = make('commit.bin')
+		with FileBuffer(fname, 'r+b', journal=True) as buf:
+			buf.source.write(100, 'abcd')
+			buf.source.write(9998, 'tail')
+			buf.commit()
+
+		self.assertEqual(contents(fname), original[:100] + 'abcd' + original[104:9998] + 'tail')
+		self.assertFalse(os.path.exists(fname + filebuffer.journalsuffix))
+
+	def test_close_drops_uncommitted(self):
+		fname = make('dropped.bin')
+		with FileBuffer(fname, 'r+b', journal=True) as buf:
+			buf.source.write(100, 'abcd')
+		self.assertEqual(contents(fname), original)
+
+	def test_rollback_after_crash(self):
+		# the commit dies after its first write: the journal is there, the
+		# file half patched and grown. the next open puts it back
+		fname = make('crash.bin')
+		buf = FileBuffer(fname, 'r+b', journal=True)
+		buf.source.write(100, 'abcd')
+		buf.source.write(5000, 'efgh')
+		buf.source.write(9998, 'tail')
+
+		inner = buf.source.source
+		write = inner.write
+		calls = []
+		def failing(offset, data):
+			if calls:
+				raise Crash()
+			calls.append(offset)
+			write(offset, data)
+		inner.write = failing
+
+		with self.assertRaises(Crash):
+			buf.commit()
+		buf.fp.close()
+
+		self.assertNotEqual(contents(fname), original)
+		self.assertTrue(os.path.exists(fname + filebuffer.journalsuffix))
+
+		FileBuffer(fname, 'r+b', journal=True).close()
+		self.assertEqual(contents(fname), original)
+		self.assertFalse(os.path.exists(fname + filebuffer.journalsuffix))
+
+	def test_cut_journal_leaves_file(self):
+		# the crash came while writing the journal: the file wasn't touched yet
+		fname = make('cutjournal.bin')
+		with open(fname + filebuffer.journalsuffix, 'wb') as jf:
+			jf.write(filebuffer.journalmagic + struct.pack('>QQQ', len(original), 100, 4) + original[100:102])
+
+		self.assertTrue(filebuffer.rollback(fname, fname + filebuffer.journalsuffix))
+		self.assertEqual(contents(fname), original)
+		self.assertFalse(os.path.exists(fname + filebuffer.journalsuffix))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from fixtures import mp4check, media, scratch, packet_hashes, needs_ffmpeg
+from filetools import FileBuffer
+import mp4concat
+import mp4cut
+
+@needs_ffmpeg
+class TestConcat(unittest.TestCase):
+	def test_concat(self):
+		# the same recording twice: descriptions and edit lists match (ffmpeg's
+		# files from separate runs differ in the bitrate fields)
+		inputs = [media(), media()]
+		outfname = scratch('concat.mp4')
+		starts = mp4concat.concat(inputs, outfname)
+		self.assertAlmostEqual(starts[1], 4.0, delta=0.05)
+
+		tracks = mp4check.track_indexes(FileBuffer(outfname))
+		(video,) = [tracks[track_id].samples for track_id in tracks if tracks[track_id].handler == 'vide']
+		self.assertEqual(len(video), 200)
+		self.assertEqual(video.keyframe.sum(), 8)
+		self.assertTrue((video.dts[100:] >= 4 * video.timescale).all())
+
+		for stream in ('v:0', 'a:0'):
+			self.assertEqual(packet_hashes(outfname, stream), packet_hashes(media(), stream) * 2)
+		self.assertEqual(len(packet_hashes(outfname, 'v:0', decode=True)), 200)
+
+		# the first input's edit list, over the whole
+		(edit,) = mp4concat.edit_list(mp4check.track_indexes(FileBuffer(inputs[0]))[1].trak)
+		(merged,) = mp4concat.edit_list(tracks[1].trak)
+		self.assertEqual(merged['start'], edit['start'])
+
+	def test_edit_lists_must_match(self):
+		# a cut's second part starts past the audio's priming, the first doesn't
+		inputs = [scratch('part1.mp4'), scratch('part2.mp4')]
+		mp4cut.cut(media(), inputs[0], 0, 2)
+		mp4cut.cut(media(), inputs[1], 2)
+		with self.assertRaises(AssertionError):
+			mp4concat.concat(inputs, scratch('mismatched.mp4'))
+
+	def test_fragmented_refused(self):
+		with self.assertRaises(AssertionError):
+			mp4concat.concat([media(), media('fragmented')], scratch('refused.mp4'))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+
+from fixtures import mp4check, media, scratch, packet_hashes, needs_ffmpeg
+from filetools import FileBuffer
+import mp4cut
+
+def tracks_by_handler(fname):
+	tracks = mp4check.track_indexes(FileBuffer(fname))
+	return dict((tracks[track_id].handler, tracks[track_id]) for track_id in tracks)
+
+class TestHelpers(unittest.TestCase):
+	def test_parse_time(self):
+		self.assertEqual(mp4cut.parse_time('90'), 90)
+		self.assertEqual(mp4cut.parse_time('1:30.5'), 90.5)
+		self.assertEqual(mp4cut.parse_time('1:00:00'), 3600)
+
+	def test_runs(self):
+		(starts, lengths) = mp4cut.runs(np.array([5, 5, 7, 7, 7, 5]))
+		self.assertEqual((starts.tolist(), lengths.tolist()), ([0, 2, 5], [2, 3, 1]))
+
+	def test_byte_ranges(self):
+		# merged across small gaps and where one sample covers others
+		offsets = np.array([0, 10, 5, 1000, 3000])
+		sizes = np.array([100, 10, 10, 10, 10])
+		(starts, ends) = mp4cut.byte_ranges(offsets, sizes, maxgap=1000)
+		self.assertEqual((starts.tolist(), ends.tolist()), ([0, 3000], [1010, 3010]))
+
+		outstarts = np.cumsum(ends - starts) - (ends - starts)
+		self.assertEqual(mp4cut.relocate(np.array([5, 1000, 3005]), starts, outstarts).tolist(), [5, 1000, 1015])
+
+@needs_ffmpeg
+class TestCut(unittest.TestCase):
+	def test_cut_to_keyframes(self):
+		outfname = scratch('cut.mp4')
+		(t0, t1) = mp4cut.cut(media(), outfname, 1.3, 2.5)
+		self.assertEqual((t0, t1), (1.0, 3.0))
+
+		(before, after) = (tracks_by_handler(media()), tracks_by_handler(outfname))
+		video = after['vide'].samples
+		self.assertEqual(len(video), 50)
+		self.assertEqual(np.flatnonzero(video.keyframe).tolist(), [0, 25])
+		self.assertEqual(video.dts[0], 0)
+		self.assertEqual(video.duration, 2 * video.timescale)
+
+		# the same packets, found where the new tables say
+		self.assertEqual(packet_hashes(outfname, 'v:0'), packet_hashes(media(), 'v:0')[25:75])
+		self.assertEqual(len(packet_hashes(outfname, 'v:0', decode=True)), 50)
+
+		audio = (before['soun'].samples, after['soun'].samples)
+		first = int(np.searchsorted(audio[0].dts, 1.0 * audio[0].timescale))
+		self.assertEqual(audio[1].size.tolist(), audio[0].size[first:first+len(audio[1])].tolist())
+
+	def test_uncut_start_keeps_edit(self):
+		outfname = scratch('head.mp4')
+		mp4cut.cut(media(), outfname, 0, 2)
+
+		for handler in ('vide', 'soun'):
+			(before, after) = (tracks_by_handler(media())[handler], tracks_by_handler(outfname)[handler])
+			(edit,) = mp4cut.edit_list(after.trak)
+			self.assertEqual(edit['start'], mp4cut.edit_list(before.trak)[0]['start'])
+
+		self.assertEqual(packet_hashes(outfname, 'a:0'), packet_hashes(media(), 'a:0')[:len(packet_hashes(outfname, 'a:0'))])
+
+if __name__ == '__main__':
+	unittest.main()
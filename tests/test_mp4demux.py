@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+import subprocess
+import numpy as np
+
+from fixtures import media, scratch, packet_hashes, needs_ffmpeg
+from mp4check import SampleIndex
+from filetools import FileBuffer
+import mp4demux
+
+demuxer = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mp4demux.py')
+
+class TestHelpers(unittest.TestCase):
+	def test_adts_header(self):
+		# AAC LC, 44.1 kHz, mono, 300 byte frame
+		(header,) = mp4demux.adts_headers((2, 4, 1), np.array([300]))
+		self.assertEqual(header.tostring(), '\xff\xf1\x50\x40\x26\x7f\xfc')
+
+	def test_nal_units(self):
+		data = '\x00\x00\x00\x02\x65\xaa' + '\x00\x00\x00\x01\x06'
+		self.assertEqual(mp4demux.nal_units(data, 4), ([0, 6], [5, 6]))
+		self.assertEqual(mp4demux.nal_units('\x00\x01\x41', 2), ([0], [1]))
+
+	def test_runs(self):
+		samples = SampleIndex(np.array([0, 10, 20, 100]), np.array([10, 10, 10, 10]), np.arange(4), np.arange(4), np.ones(4, dtype=bool), 1)
+		self.assertEqual(list(mp4demux.runs(samples)), [(0, 3), (3, 4)])
+		self.assertEqual(list(mp4demux.runs(samples, maxsize=15)), [(0, 1), (1, 2), (2, 3), (3, 4)])
+		self.assertEqual(list(mp4demux.runs(samples, breaks=np.array([False, True, False, False]))), [(0, 1), (1, 3), (3, 4)])
+
+@needs_ffmpeg
+class TestDemux(unittest.TestCase):
+	def test_video(self):
+		outfname = scratch('video.h264')
+		with open(outfname, 'wb') as outfp:
+			(track, format) = mp4demux.demux(media(), outfp, handler='vide')
+		self.assertEqual(format, 'avc1')
+
+		decoded = packet_hashes(outfname, 'v:0', decode=True)
+		self.assertEqual(len(decoded), 100)
+		self.assertEqual(sorted(decoded), sorted(packet_hashes(media(), 'v:0', decode=True)))
+
+	def test_audio(self):
+		outfname = scratch('audio.aac')
+		with open(outfname, 'wb') as outfp:
+			(track, format) = mp4demux.demux(media(), outfp, handler='soun')
+		self.assertEqual(format, 'mp4a')
+
+		# the track's frames, each behind a header that gives its length
+		with open(outfname, 'rb') as fh:
+			data = fh.read()
+		frames = []
+		pos = 0
+		while pos < len(data):
+			self.assertEqual(data[pos:pos+2], '\xff\xf1')
+			length = ((ord(data[pos+3]) & 3) << 11) | (ord(data[pos+4]) << 3) | (ord(data[pos+5]) >> 5)
+			frames.append(data[pos+7:pos+length])
+			pos += length
+
+		buf = FileBuffer(media())
+		samples = track.samples
+		self.assertEqual(frames, [
+			buf[offset:offset+size].str()
+			for (offset, size) in zip(samples.offset.tolist(), samples.size.tolist())
+		])
+		self.assertEqual(len(packet_hashes(outfname, 'a:0', decode=True)), len(samples))
+
+	def test_pipe(self):
+		outfname = scratch('file.h264')
+		with open(outfname, 'wb') as outfp:
+			mp4demux.demux(media(), outfp, handler='vide')
+
+		piped = subprocess.check_output([sys.executable, demuxer, '--video', media(), '-'], stderr=open(os.devnull, 'w'))
+		with open(outfname, 'rb') as fh:
+			self.assertEqual(piped, fh.read())
+
+if __name__ == '__main__':
+	unittest.main()
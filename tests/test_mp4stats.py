@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+
+from fixtures import mp4check, media, needs_ffmpeg
+from mp4check import SampleIndex, Record
+from filetools import FileBuffer
+import mp4stats
+
+def track(n, delta, timescale, lastdelta, keyevery=10):
+	samples = SampleIndex(
+		np.arange(n) * 100, np.full(n, 10, dtype=np.int64),
+		np.arange(n) * delta, np.arange(n) * delta,
+		np.arange(n) % keyevery == 0, timescale, lastdelta)
+	return Record(track_id=1, handler='vide', samples=samples)
+
+class TestStats(unittest.TestCase):
+	def test_per_second(self):
+		(nbytes, nsamples, keyframes) = mp4stats.per_second(track(50, 1000, 25000, 1000).samples)
+		self.assertEqual(nsamples.tolist(), [25, 25])
+		self.assertEqual(nbytes.tolist(), [250, 250])
+		self.assertEqual(keyframes.tolist(), [3, 2])
+
+	def test_last_second(self):
+		# counted when complete, left out when not
+		whole = mp4stats.analyze(track(50, 1000, 25000, 1000))
+		self.assertEqual(whole['bits_per_second']['count'], 2)
+		self.assertEqual(whole['duration'], 2.0)
+
+		partial = mp4stats.analyze(track(50, 1000, 25000, 500))
+		self.assertEqual(partial['bits_per_second']['count'], 1)
+
+	def test_gops(self):
+		(starts, lengths, nbytes, durations) = mp4stats.gops(track(25, 1000, 25000, 1000).samples)
+		self.assertEqual(lengths.tolist(), [10, 10, 5])
+		self.assertEqual(nbytes.tolist(), [100, 100, 50])
+		self.assertEqual(durations.tolist(), [0.4, 0.4, 0.2])
+
+	@needs_ffmpeg
+	def test_file(self):
+		tracks = mp4check.track_indexes(FileBuffer(media()))
+		(video,) = [mp4stats.analyze(tracks[track_id]) for track_id in tracks if tracks[track_id].handler == 'vide']
+
+		self.assertEqual(video['samples'], 100)
+		self.assertEqual(video['keyframes'], 4)
+		self.assertEqual(video['duration'], 4.0)
+		self.assertEqual(video['gop_samples'], {'count': 4, 'min': 25, 'max': 25, 'mean': 25.0})
+		self.assertEqual(video['keyframe_interval']['mean'], 1.0)
+		self.assertEqual(video['bits_per_second']['count'], 4)
+
+if __name__ == '__main__':
+	unittest.main()
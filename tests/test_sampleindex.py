@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+
+from fixtures import mp4check, media, needs_ffmpeg
+from filetools import FileBuffer
+
+class TestSampleIndex(unittest.TestCase):
+	def test_columns(self):
+		index = mp4check.SampleIndex(
+			np.array([100, 300, 200]), np.array([100, 50, 100]),
+			np.array([0, 10, 20]), np.array([10, 30, 20]),
+			np.array([True, False, False]), timescale=10, lastdelta=5)
+
+		self.assertEqual(len(index), 3)
+		self.assertEqual(index.duration, 25)
+		self.assertEqual(index.at_time(15), 1)
+		self.assertEqual(index.at_time(-1), None)
+		self.assertEqual(index.keyframe_at_time(25), 0)
+		self.assertEqual(index.at_offset(250), 2)
+		self.assertEqual(index.at_offset(360), None)
+
+	def test_duration_without_lastdelta(self):
+		# the last sample gets the one before's
+		index = mp4check.SampleIndex(
+			np.zeros(3, dtype=np.int64), np.zeros(3, dtype=np.int64),
+			np.array([0, 10, 30]), np.array([0, 10, 30]),
+			np.ones(3, dtype=bool), timescale=10)
+		self.assertEqual(index.duration, 50)
+
+	def test_concatenate(self):
+		parts = [
+			mp4check.SampleIndex(np.array([0]), np.array([1]), np.array([0]), np.array([0]), np.array([True]), 10, lastdelta=3),
+			mp4check.SampleIndex(np.array([1]), np.array([1]), np.array([3]), np.array([3]), np.array([False]), 10, lastdelta=7),
+		]
+		index = mp4check.SampleIndex.concatenate(parts)
+		self.assertEqual(index.dts.tolist(), [0, 3])
+		self.assertEqual(index.keyframe.tolist(), [True, False])
+		self.assertEqual(index.duration, 10)
+
+@needs_ffmpeg
+class TestTrackIndexes(unittest.TestCase):
+	def test_from_moov(self):
+		tracks = mp4check.track_indexes(FileBuffer(media()))
+		handlers = dict((tracks[track_id].handler, tracks[track_id]) for track_id in tracks)
+
+		video = handlers['vide'].samples
+		self.assertEqual(len(video), 100)
+		self.assertEqual(video.duration, 4 * video.timescale)
+		self.assertEqual(np.flatnonzero(video.keyframe).tolist(), [0, 25, 50, 75])
+		self.assertTrue((np.diff(video.dts) > 0).all())
+		self.assertTrue((video.cts >= video.dts).all())
+
+		audio = handlers['soun'].samples
+		self.assertEqual(audio.timescale, 44100)
+		self.assertAlmostEqual(audio.duration / 44100.0, 4.0, delta=0.05)
+
+	def test_fragments_match_moov(self):
+		# video only: ffmpeg times the fragmented file's audio differently
+		plain = mp4check.track_indexes(FileBuffer(media()))
+		fragmented = mp4check.track_indexes(FileBuffer(media('fragmented')))
+
+		for track_id in plain:
+			if plain[track_id].handler != 'vide':
+				continue
+			(a, b) = (plain[track_id].samples, fragmented[track_id].samples)
+			self.assertEqual(a.size.tolist(), b.size.tolist())
+			self.assertEqual(a.dts.tolist(), b.dts.tolist())
+			self.assertEqual(a.cts.tolist(), b.cts.tolist())
+			self.assertEqual(a.keyframe.tolist(), b.keyframe.tolist())
+			self.assertEqual(a.duration, b.duration)
+
+if __name__ == '__main__':
+	unittest.main()
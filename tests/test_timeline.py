@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+
+from fixtures import mp4check, media, needs_ffmpeg
+from mp4check import SampleIndex, Timeline
+from filetools import FileBuffer
+
+def samples(n=10, timescale=10):
+	# a sample per 1/timescale, shown in decode order
+	return SampleIndex(
+		np.arange(n) * 100, np.full(n, 100, dtype=np.int64),
+		np.arange(n), np.arange(n), np.ones(n, dtype=bool), timescale, lastdelta=1)
+
+class TestTimeline(unittest.TestCase):
+	def test_no_edits(self):
+		timeline = Timeline(samples())
+		self.assertEqual(timeline.to_media([0, 0.55]).tolist(), [0, 0.55])
+		self.assertEqual(timeline.sample_at([0, 0.55, 0.99, 1.0]).tolist(), [0, 5, 9, -1])
+
+	def test_empty_edit_and_media_start(self):
+		# half a second of nothing, then from media time 0.2 on
+		edits = [
+			{'duration': 500, 'start': -1, 'rate': 1.0},
+			{'duration': 500, 'start': 2, 'rate': 1.0},
+		]
+		timeline = Timeline(samples(), edits, movietimescale=1000)
+
+		self.assertTrue(np.isnan(timeline.to_media(0.25)))
+		self.assertAlmostEqual(float(timeline.to_media(0.5)), 0.2)
+		self.assertEqual(timeline.sample_at([0.25, 0.5, 0.85, 1.0]).tolist(), [-1, 2, 5, -1])
+		times = timeline.presentation_times([0, 2, 6])
+		self.assertTrue(np.isnan(times[0])) # before the media start, never shown
+		self.assertTrue(np.allclose(times[1:], [0.5, 0.9]))
+
+	def test_rate(self):
+		edits = [{'duration': 1000, 'start': 0, 'rate': 0.5}]
+		timeline = Timeline(samples(), edits, movietimescale=1000)
+		self.assertAlmostEqual(float(timeline.to_media(0.8)), 0.4)
+		self.assertAlmostEqual(float(timeline.to_presentation(0.4)), 0.8)
+
+	@needs_ffmpeg
+	def test_file(self):
+		timelines = mp4check.timelines(FileBuffer(media()))
+		(video,) = [timelines[track_id] for track_id in timelines if timelines[track_id].handler == 'vide']
+
+		# B-frames: the edit starts at the first presented frame; shown in order, 25 a second
+		shown = video.sample_at(np.arange(100) / 25.0 + 0.01)
+		self.assertEqual(sorted(shown.tolist()), range(100))
+		self.assertEqual(shown[0], 0)
+		self.assertEqual(video.sample_at(4.5), -1)
+
+		times = video.presentation_times()
+		self.assertAlmostEqual(float(times.min()), 0.0)
+		self.assertAlmostEqual(float(times.max()), 3.96)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,72 @@
+import os
+import struct
+import unittest
+
+from fixtures import mp4check, media, scratch, needs_ffmpeg
+from filetools import FileBuffer
+
+def faststarted(name):
+	fname = scratch(name)
+	mp4check.faststart(media(), fname)
+	return fname
+
+def chunk_offsets_at(fname):
+	# file position of each track's stco entries
+	tree = mp4check.parse(FileBuffer(fname), lazy=True)
+	positions = {}
+	for trak in mp4check.select(tree, ['moov']):
+		if trak.type != 'trak':
+			continue
+		track_id = mp4check.select(trak.content, ['tkhd']).track_id
+		(stco,) = [atom for atom in mp4check.select(trak.content, ['mdia', 'minf', 'stbl']) if atom.type == 'stco']
+		positions[track_id] = stco.start + 8 + 8
+	return positions
+
+@needs_ffmpeg
+class TestVerify(unittest.TestCase):
+	def test_clean(self):
+		check = mp4check.verify_samples(FileBuffer(faststarted('clean.mp4')))
+		self.assertEqual((check.outside, check.overlapping), (0, 0))
+		self.assertEqual(check.recoverable_ms, check.total_ms)
+
+	def test_cut_short(self):
+		fname = faststarted('short.mp4')
+		with open(fname, 'r+b') as fh:
+			fh.truncate(os.path.getsize(fname) * 6 // 10)
+
+		check = mp4check.verify_samples(FileBuffer(fname))
+		self.assertTrue(check.outside > 0)
+		self.assertTrue(check.recoverable_ms < check.total_ms)
+		for track in check.tracks:
+			self.assertTrue(track.playable_ms <= track.recoverable_ms)
+
+	def test_overlaps(self):
+		# the audio's first chunks moved into the first (big) video frame, side
+		# by side: each starts inside that frame, none inside the one before
+		fname = faststarted('overlap.mp4')
+		positions = chunk_offsets_at(fname)
+		(video, audio) = sorted(positions)
+		with open(fname, 'r+b') as fh:
+			fh.seek(positions[video])
+			(offset,) = struct.unpack('>I', fh.read(4))
+			fh.seek(positions[audio])
+			fh.write(struct.pack('>4I', offset + 1, offset + 400, offset + 800, offset + 1200))
+
+		buf = FileBuffer(fname)
+		tracks = mp4check.track_indexes(buf)
+		spans = sorted(
+			(start, start + size)
+			for track in tracks.values()
+			for (start, size) in zip(track.samples.offset.tolist(), track.samples.size.tolist())
+		)
+		expected = sum(
+			1 for (i, (start, end)) in enumerate(spans)
+			if end > start and any(start < otherend for (otherstart, otherend) in spans[:i])
+		)
+
+		check = mp4check.verify_samples(buf)
+		self.assertTrue(expected > 1)
+		self.assertEqual(check.overlapping, expected)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -4,6 +4,7 @@ import os
 import sys
 import json
 import pprint; pp = pprint.pprint
+import numpy as np
 
 import mp4select
 import mp4check
@@ -24,17 +25,26 @@ data = {}
 data['frameWidth'] = dimensions.width
 data['frameHeight'] = dimensions.height
 
-atoms = mp4check.parse(filebuf)
+atoms = mp4check.parse(filebuf, lazy=True)
 mvhd = mp4check.select(atoms, 'moov mvhd'.split())
 data['duration'] = duration = mvhd.duration / mvhd.timescale
 
+# the recorder's times are media time of the video; the edit list says when that shows.
+# times the edits leave out keep their recorded value
+timelines = mp4check.timelines(filebuf)
+videos = [timelines[track_id] for track_id in sorted(timelines) if timelines[track_id].handler == 'vide']
+assert videos, "%s has no video track to place the markers on" % fname
+timeline = videos[0]
+recorded = [rec.time for rec in titles]
+starts = timeline.to_presentation(recorded)
+
 titles = [
 	{
 		'name': rec.text,
-		'start': rec.time,
+		'start': time if np.isnan(start) else float(start),
 		#'duration': duration # we don't have that here
 	}
-	for rec in titles
+	for (rec, time, start) in zip(titles, recorded, starts)
 ]
 
 data['chapters'] = titles